@@ -0,0 +1,20 @@
+"""
+Optional native build of the model modules with mypyc.
+
+    python build_mypyc.py build_ext --inplace
+
+This drops compiled extensions next to src/models/archive.py and
+src/models/snapshot.py, which Python then imports in preference to the
+sources. Without the build the pure-Python modules are used unchanged.
+"""
+from setuptools import setup
+from mypyc.build import mypycify
+
+setup(
+    name='govwatcher-archive-models',
+    package_dir={'': 'src'},
+    ext_modules=mypycify([
+        'src/models/archive.py',
+        'src/models/snapshot.py',
+    ]),
+)
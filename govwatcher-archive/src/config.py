@@ -2,70 +2,103 @@
 GovWatcher Archive System Configuration
 """
 import os
+import functools
+from dataclasses import dataclass
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+@dataclass(frozen=True)
 class Config:
-    """Configuration settings for the archive system"""
+    """Configuration settings for the archive system.
     
-    def __init__(self):
-        # Database settings
-        self.DB_HOST = os.getenv('DB_HOST', 'db')
-        self.DB_PORT = int(os.getenv('DB_PORT', '5432'))
-        self.DB_NAME = os.getenv('DB_NAME', 'govwatcher')
-        self.DB_USER = os.getenv('DB_USER', 'archive_admin')
-        self.DB_PASSWORD = os.getenv('DB_PASSWORD', 'password')
-        
-        # Redis settings
-        self.REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
-        self.REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
-        self.REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', '')
-        
-        # Archive storage settings
-        self.STORAGE_PATH = os.getenv('ARCHIVE_DATA_PATH', '/data/archives')
-        self.WARC_SUBDIR = 'warc'
-        self.SCREENSHOT_SUBDIR = 'screenshots'
-        self.HTML_SUBDIR = 'html'
-        self.PDF_SUBDIR = 'pdf'
-        self.TEXT_SUBDIR = 'text'
-        self.DIFF_SUBDIR = 'diffs'
-        
-        # Crawler settings
-        self.CRAWLER_USER_AGENT = os.getenv('CRAWLER_USER_AGENT', 
-            'GovWatcher/1.0 (+https://govwatcher.org/bot; bot@govwatcher.org)')
-        self.MAX_CRAWL_DEPTH = int(os.getenv('MAX_CRAWL_DEPTH', '3'))
-        self.MAX_CRAWL_PAGES = int(os.getenv('MAX_CRAWL_PAGES', '1000'))
-        self.CRAWL_TIMEOUT = int(os.getenv('CRAWL_TIMEOUT', '300'))  # seconds
-        self.CRAWL_DELAY = float(os.getenv('CRAWL_DELAY', '1.0'))  # seconds between requests
-        self.MAX_RETRIES = int(os.getenv('MAX_RETRIES', '3'))
-        self.RETRY_DELAY = int(os.getenv('RETRY_DELAY', '60'))  # seconds
-        
-        # Concurrency settings
-        self.MAX_CONCURRENT_CRAWLS = int(os.getenv('MAX_CONCURRENT_CRAWLS', '3'))
-        self.QUEUE_PROCESSING_INTERVAL = int(os.getenv('QUEUE_PROCESSING_INTERVAL', '10'))  # seconds
-        
-        # Queue priority thresholds
-        self.HIGH_PRIORITY_THRESHOLD = int(os.getenv('HIGH_PRIORITY_THRESHOLD', '1'))
-        self.NORMAL_PRIORITY_THRESHOLD = int(os.getenv('NORMAL_PRIORITY_THRESHOLD', '3'))
-        
-        # Scheduled check intervals (in seconds)
-        self.HIGH_PRIORITY_INTERVAL = int(os.getenv('HIGH_PRIORITY_INTERVAL', str(7 * 24 * 3600)))  # 1 week
-        self.NORMAL_PRIORITY_INTERVAL = int(os.getenv('NORMAL_PRIORITY_INTERVAL', str(14 * 24 * 3600)))  # 2 weeks
-        self.LOW_PRIORITY_INTERVAL = int(os.getenv('LOW_PRIORITY_INTERVAL', str(30 * 24 * 3600)))  # 1 month
-        
-        # Diff settings
-        self.DIFF_SIMILARITY_THRESHOLD = float(os.getenv('DIFF_SIMILARITY_THRESHOLD', '0.9'))
-        self.DIFF_SIZE_THRESHOLD = int(os.getenv('DIFF_SIZE_THRESHOLD', '10'))  # min number of changes to be significant
-        
-        # Webhook settings
-        self.WEBHOOK_API_URL = os.getenv('WEBHOOK_API_URL', 'http://api:3000/webhooks')
-        self.WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', 'webhook_secret')
-        
-        # Feature flags
-        self.ENABLE_SCREENSHOTS = os.getenv('ENABLE_SCREENSHOTS', 'true').lower() == 'true'
-        self.ENABLE_PDF = os.getenv('ENABLE_PDF', 'true').lower() == 'true'
-        self.ENABLE_TEXT_EXTRACTION = os.getenv('ENABLE_TEXT_EXTRACTION', 'true').lower() == 'true'
-        self.ENABLE_VISUAL_DIFF = os.getenv('ENABLE_VISUAL_DIFF', 'true').lower() == 'true'
-        self.ENABLE_WEBHOOKS = os.getenv('ENABLE_WEBHOOKS', 'true').lower() == 'true' 
\ No newline at end of file
+    Every field is read from the environment exactly once, when this module
+    is imported. Use get_config() to obtain the shared instance.
+    """
+    
+    # Database settings
+    DB_HOST: str = os.getenv('DB_HOST', 'db')
+    DB_PORT: int = int(os.getenv('DB_PORT', '5432'))
+    DB_NAME: str = os.getenv('DB_NAME', 'govwatcher')
+    DB_USER: str = os.getenv('DB_USER', 'archive_admin')
+    DB_PASSWORD: str = os.getenv('DB_PASSWORD', 'password')
+    DB_MAX_CONNS: int = int(os.getenv('DB_MAX_CONNS', '10'))  # connection pool size
+    
+    # Redis settings
+    REDIS_HOST: str = os.getenv('REDIS_HOST', 'redis')
+    REDIS_PORT: int = int(os.getenv('REDIS_PORT', '6379'))
+    REDIS_PASSWORD: str = os.getenv('REDIS_PASSWORD', '')
+    
+    # Archive storage settings
+    STORAGE_PATH: str = os.getenv('ARCHIVE_DATA_PATH', '/data/archives')
+    WARC_SUBDIR: str = 'warc'
+    SCREENSHOT_SUBDIR: str = 'screenshots'
+    HTML_SUBDIR: str = 'html'
+    PDF_SUBDIR: str = 'pdf'
+    TEXT_SUBDIR: str = 'text'
+    DIFF_SUBDIR: str = 'diffs'
+    
+    # Crawler settings
+    CRAWLER_USER_AGENT: str = os.getenv('CRAWLER_USER_AGENT', 
+        'GovWatcher/1.0 (+https://govwatcher.org/bot; bot@govwatcher.org)')
+    MAX_CRAWL_DEPTH: int = int(os.getenv('MAX_CRAWL_DEPTH', '3'))
+    MAX_CRAWL_PAGES: int = int(os.getenv('MAX_CRAWL_PAGES', '1000'))
+    CRAWL_TIMEOUT: int = int(os.getenv('CRAWL_TIMEOUT', '300'))  # seconds
+    CRAWL_DELAY: float = float(os.getenv('CRAWL_DELAY', '1.0'))  # seconds between requests
+    MAX_RETRIES: int = int(os.getenv('MAX_RETRIES', '3'))
+    RETRY_DELAY: int = int(os.getenv('RETRY_DELAY', '60'))  # seconds
+    SELENIUM_MAX_WAIT: int = int(os.getenv('SELENIUM_MAX_WAIT', '10'))  # max seconds to wait for page load
+    HASH_ALGO: str = os.getenv('HASH_ALGO', 'blake3')  # content hash for change detection, blake3 or sha256
+    
+    # Concurrency settings
+    MAX_CONCURRENT_CRAWLS: int = int(os.getenv('MAX_CONCURRENT_CRAWLS', '3'))
+    QUEUE_PROCESSING_INTERVAL: int = int(os.getenv('QUEUE_PROCESSING_INTERVAL', '10'))  # seconds
+    MAX_DIFF_WORKERS: int = int(os.getenv('MAX_DIFF_WORKERS', str(os.cpu_count() or 1)))  # diff worker processes
+    
+    # Queue priority thresholds
+    HIGH_PRIORITY_THRESHOLD: int = int(os.getenv('HIGH_PRIORITY_THRESHOLD', '1'))
+    NORMAL_PRIORITY_THRESHOLD: int = int(os.getenv('NORMAL_PRIORITY_THRESHOLD', '3'))
+    
+    # Queue priority for archives at or below each threshold (looked up with bisect)
+    PRIORITY_BUCKETS: tuple = (HIGH_PRIORITY_THRESHOLD, NORMAL_PRIORITY_THRESHOLD)
+    PRIORITY_VALUES: tuple = (1, 3, 5)
+    
+    # Scheduled check intervals (in seconds)
+    HIGH_PRIORITY_INTERVAL: int = int(os.getenv('HIGH_PRIORITY_INTERVAL', str(7 * 24 * 3600)))  # 1 week
+    NORMAL_PRIORITY_INTERVAL: int = int(os.getenv('NORMAL_PRIORITY_INTERVAL', str(14 * 24 * 3600)))  # 2 weeks
+    LOW_PRIORITY_INTERVAL: int = int(os.getenv('LOW_PRIORITY_INTERVAL', str(30 * 24 * 3600)))  # 1 month
+    
+    # Check interval for archives at or below each PRIORITY_BUCKETS threshold
+    PRIORITY_INTERVALS: tuple = (HIGH_PRIORITY_INTERVAL, NORMAL_PRIORITY_INTERVAL, LOW_PRIORITY_INTERVAL)
+    
+    # Diff settings
+    DIFF_SIMILARITY_THRESHOLD: float = float(os.getenv('DIFF_SIMILARITY_THRESHOLD', '0.9'))
+    DIFF_SIZE_THRESHOLD: int = int(os.getenv('DIFF_SIZE_THRESHOLD', '10'))  # min number of changes to be significant
+    
+    # Webhook settings
+    WEBHOOK_API_URL: str = os.getenv('WEBHOOK_API_URL', 'http://api:3000/webhooks')
+    WEBHOOK_SECRET: str = os.getenv('WEBHOOK_SECRET', 'webhook_secret')
+    
+    # Feature flags
+    ENABLE_SCREENSHOTS: bool = os.getenv('ENABLE_SCREENSHOTS', 'true').lower() == 'true'
+    ENABLE_PDF: bool = os.getenv('ENABLE_PDF', 'true').lower() == 'true'
+    ENABLE_TEXT_EXTRACTION: bool = os.getenv('ENABLE_TEXT_EXTRACTION', 'true').lower() == 'true'
+    ENABLE_VISUAL_DIFF: bool = os.getenv('ENABLE_VISUAL_DIFF', 'true').lower() == 'true'
+    ENABLE_WEBHOOKS: bool = os.getenv('ENABLE_WEBHOOKS', 'true').lower() == 'true'
+    
+    def __post_init__(self):
+        """Reject settings that can't work together"""
+        # Every crawl thread holds a pooled connection, plus one for the main loop
+        if self.DB_MAX_CONNS < self.MAX_CONCURRENT_CRAWLS + 1:
+            raise ValueError(
+                f"DB_MAX_CONNS ({self.DB_MAX_CONNS}) must be at least "
+                f"MAX_CONCURRENT_CRAWLS + 1 ({self.MAX_CONCURRENT_CRAWLS + 1})"
+            )
+
+@functools.lru_cache(maxsize=1)
+def get_config():
+    """Return the process-wide configuration instance"""
+    return Config()
+
+CONFIG = get_config()
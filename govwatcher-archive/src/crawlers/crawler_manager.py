@@ -1,6 +1,10 @@
+import bisect
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from crawlers.webpage_crawler import WebpageCrawler
 from models.archive import Archive
 from models.snapshot import Snapshot
 
@@ -15,94 +19,240 @@ class CrawlerManager:
         self.redis = redis_client
         self.storage = storage_manager
         self.active_crawls = set()
-        self.from_imports = __import__('crawlers.webpage_crawler', fromlist=['WebpageCrawler']).WebpageCrawler
+        self._active_lock = threading.Lock()
+        
+        # Crawls are I/O bound, so run them on a bounded pool of worker threads
+        self._pool = ThreadPoolExecutor(
+            max_workers=config.MAX_CONCURRENT_CRAWLS,
+            thread_name_prefix='crawler'
+        )
+        self._futures = {}  # job id -> Future of its running crawl
+        
+        # Each worker thread keeps its own long-lived crawler (session and browser)
+        self._local = threading.local()
+    
+    def shutdown(self, wait=True):
+        """Stop accepting crawls and wait for the running ones to finish"""
+        self._pool.shutdown(wait=wait)
+    
+    def _get_crawler(self):
+        """Get the crawler owned by the current thread, creating it on first use"""
+        crawler = getattr(self._local, 'crawler', None)
+        if crawler is None:
+            crawler = WebpageCrawler(self.config)
+            self._local.crawler = crawler
+        return crawler
+    
+    def _drain_completed(self):
+        """Forget crawls that have finished since the last tick"""
+        for job_id, future in list(self._futures.items()):
+            if not future.done():
+                continue
+            
+            del self._futures[job_id]
+            if future.exception():
+                logger.error(f"Crawl worker for job {job_id} raised: {future.exception()}")
     
     def process_queue(self):
         """Process the archive queue to find sites that need crawling"""
+        self._drain_completed()
+        
         # Check if we have capacity for more crawls
-        if len(self.active_crawls) >= self.config.MAX_CONCURRENT_CRAWLS:
-            logger.debug(f"Already at max concurrent crawls: {len(self.active_crawls)}")
+        if len(self._futures) >= self.config.MAX_CONCURRENT_CRAWLS:
+            logger.debug(f"Already at max concurrent crawls: {len(self._futures)}")
             return
         
-        available_slots = self.config.MAX_CONCURRENT_CRAWLS - len(self.active_crawls)
+        available_slots = self.config.MAX_CONCURRENT_CRAWLS - len(self._futures)
         
-        # Get archives that need checking based on priority and last check time
-        pending_archives = Archive.get_pending(self.db, max_records=available_slots)
+        # Keep the archive rows locked until their queue entries are committed,
+        # so concurrent workers never pick the same archive
+        crawl_jobs = []
+        with self.db.transaction():
+            # Get archives that need checking based on priority and last check time
+            pending_archives = Archive.get_pending(
+                self.db, max_records=available_slots,
+                buckets=self.config.PRIORITY_BUCKETS,
+                intervals=self.config.PRIORITY_INTERVALS
+            )
+            
+            if pending_archives:
+                logger.info(f"Found {len(pending_archives)} archives to process")
+                
+                # Schedule all archives for crawling in one batch
+                crawl_jobs = self._schedule_archives(pending_archives)
         
-        if not pending_archives:
-            return
+        # Only announce the crawls once their queue rows are committed
+        self._push_jobs('archive:crawl', crawl_jobs)
         
-        logger.info(f"Found {len(pending_archives)} archives to process")
+        # Pull a batch of crawl jobs in one round-trip and hand them to the worker pool
+        for job in self.redis.dequeue_batch('archive:crawl', available_slots):
+            self._futures[job['id']] = self._pool.submit(self._run_crawl_job, job)
+    
+    def _run_crawl_job(self, job):
+        """Crawl the archive referenced by a dequeued job and record the outcome"""
+        queue_name = 'archive:crawl'
+        archive_id = job['data'].get('id')
+        
+        self._start_queue_row(archive_id, 'crawl')
+        retry = True
+        try:
+            archive = Archive.get_by_id(self.db, archive_id)
+            if archive:
+                success = self.crawl_archive(archive)
+                error = None if success else f"Crawl failed for {archive.domain}"
+            else:
+                success, error, retry = False, 'Archive not found', False
+        except Exception as e:
+            logger.exception(f"Crawl job {job['id']} raised: {e}")
+            success, error = False, f"Crawl raised an exception: {e}"
         
-        # Schedule each archive for crawling
-        for archive in pending_archives:
-            self._schedule_archive(archive)
+        if success:
+            self.redis.complete_job(queue_name, job['id'])
+            self._finish_queue_row(archive_id, 'crawl', 'completed')
+            return True
+        
+        if self.redis.fail_job(queue_name, job['id'], error=error,
+                               retry=retry, max_retries=self.config.MAX_RETRIES):
+            # The Redis job is queued again, keep its row open so get_pending doesn't schedule a second one
+            self._reopen_queue_row(archive_id, 'crawl', error)
+        else:
+            # Out of retries, close the row so get_pending schedules this archive again
+            self._finish_queue_row(archive_id, 'crawl', 'failed', error)
+        return False
+    
+    def _start_queue_row(self, archive_id, operation):
+        """Mark the archive's pending queue row for operation as in progress"""
+        self.db.execute("""
+            UPDATE archive_queue SET status = 'in_progress', started_at = NOW()
+            WHERE archive_id = %s AND operation = %s AND status = 'pending'
+        """, (archive_id, operation), commit=True)
+    
+    def _reopen_queue_row(self, archive_id, operation, error=None):
+        """Put the archive's in-progress queue row for operation back to pending for a retry"""
+        self.db.execute("""
+            UPDATE archive_queue SET status = 'pending', started_at = NULL, error_message = %s
+            WHERE archive_id = %s AND operation = %s AND status = 'in_progress'
+        """, (error, archive_id, operation), commit=True)
     
-    def _schedule_archive(self, archive):
-        """Schedule an archive for crawling"""
-        logger.info(f"Scheduling crawl for {archive.domain} (ID: {archive.id})")
+    def _finish_queue_row(self, archive_id, operation, status, error=None):
+        """Mark the archive's open queue row for operation as completed or failed"""
+        self.db.execute("""
+            UPDATE archive_queue SET status = %s, completed_at = NOW(), error_message = %s
+            WHERE archive_id = %s AND operation = %s AND status IN ('pending', 'in_progress')
+        """, (status, error, archive_id, operation), commit=True)
+    
+    def _schedule_archives(self, archives):
+        """Queue a batch of archives for crawling inside the caller's transaction.
         
-        # Determine priority based on archive priority
-        priority = 1 if archive.priority <= self.config.HIGH_PRIORITY_THRESHOLD else \
-                   3 if archive.priority <= self.config.NORMAL_PRIORITY_THRESHOLD else 5
+        Returns the crawl jobs still to be pushed to Redis once that transaction commits.
+        """
+        jobs = []
+        priority_buckets = self.config.PRIORITY_BUCKETS
+        priority_values = self.config.PRIORITY_VALUES
         
-        # Add to queue
-        job_data = {'id': archive.id, 'domain': archive.domain}
-        queue_name = 'archive:crawl'
+        for archive in archives:
+            logger.info(f"Scheduling crawl for {archive.domain} (ID: {archive.id})")
+            
+            # Determine priority based on archive priority
+            priority = priority_values[bisect.bisect_left(priority_buckets, archive.priority)]
+            
+            job_data = {'id': archive.id, 'domain': archive.domain}
+            jobs.append((archive, priority, job_data))
+        
+        self._insert_queue_rows('crawl', jobs)
+        return jobs
+    
+    def _insert_queue_rows(self, operation, jobs):
+        """Add (archive, priority, job_data) jobs to the database queue.
         
-        job_id = self.redis.enqueue_job(queue_name, job_data, priority=priority)
-        logger.debug(f"Added job {job_id} to queue {queue_name}")
+        An archive that already has an open job for operation keeps that one, a
+        unique violation here would roll back the caller's whole transaction.
+        """
+        if not jobs:
+            return
         
-        # Add to database queue
-        self.db.insert('archive_queue', {
-            'archive_id': archive.id,
-            'operation': 'crawl',
-            'status': 'pending',
-            'priority': priority,
-            'scheduled_for': datetime.now()
-        })
+        scheduled_for = datetime.now()
+        self.db.insert_many('archive_queue', [
+            {
+                'archive_id': archive.id,
+                'operation': operation,
+                'status': 'pending',
+                'priority': priority,
+                'scheduled_for': scheduled_for
+            }
+            for archive, priority, _ in jobs
+        ], on_conflict="(archive_id, operation) WHERE status IN ('pending', 'in_progress') DO NOTHING")
+    
+    def _push_jobs(self, queue_name, jobs):
+        """Add (archive, priority, job_data) jobs to the Redis queue"""
+        if not jobs:
+            return
+        
+        job_ids = self.redis.enqueue_jobs_batch(
+            queue_name, [(job_data, priority) for _, priority, job_data in jobs]
+        )
+        logger.debug(f"Added jobs {job_ids} to queue {queue_name}")
     
     def crawl_archive(self, archive):
         """Crawl a specific archive"""
-        if archive.id in self.active_crawls:
-            logger.warning(f"Archive {archive.id} is already being crawled")
-            return False
+        with self._active_lock:
+            if archive.id in self.active_crawls:
+                logger.warning(f"Archive {archive.id} is already being crawled")
+                return False
+            self.active_crawls.add(archive.id)
         
         logger.info(f"Starting crawl for {archive.domain} (ID: {archive.id})")
         
         try:
-            self.active_crawls.add(archive.id)
-            
-            # Create crawler
-            crawler = self.from_imports(self.config)
+            # Validators from the previous capture let unchanged pages short-circuit
+            previous_snapshot = Snapshot.get_latest_for_archive(self.db, archive.id)
+            previous_metadata = previous_snapshot.metadata if previous_snapshot else {}
             
             # Perform crawl
-            result = crawler.crawl(archive.domain)
+            result = self._get_crawler().crawl(
+                archive.domain,
+                if_none_match=previous_metadata.get('etag'),
+                if_modified_since=previous_metadata.get('last_modified')
+            )
             
             if result.success:
-                # Update archive last checked time
-                archive.update_check_time(self.db)
-                
-                # Create snapshot
-                snapshot = Snapshot(
-                    archive_id=archive.id,
-                    capture_timestamp=datetime.now(),
-                    warc_path=result.warc_path,
-                    screenshot_path=result.screenshot_path,
-                    html_path=result.html_path,
-                    text_path=result.text_path,
-                    pdf_path=result.pdf_path,
-                    content_hash=result.content_hash,
-                    status=result.status_code,
-                    size_bytes=result.size_bytes,
-                    metadata=result.metadata
-                )
-                
-                snapshot_id = snapshot.save(self.db)
-                logger.info(f"Created snapshot {snapshot_id} for archive {archive.id}")
+                # Record the crawl outcome in a single commit
+                with self.db.transaction():
+                    # Update archive last checked time
+                    archive.update_check_time(self.db)
+                    
+                    if result.not_modified:
+                        logger.info(f"{archive.domain} not modified since snapshot {previous_snapshot.id}")
+                        return True
+                    
+                    # Same content as the previous capture, no new snapshot needed
+                    if previous_snapshot and previous_snapshot.content_hash == result.content_hash:
+                        logger.info(f"No changes detected for {archive.domain}")
+                        return True
+                    
+                    # Create snapshot
+                    snapshot = Snapshot(
+                        archive_id=archive.id,
+                        capture_timestamp=datetime.now(),
+                        warc_path=result.warc_path,
+                        screenshot_path=result.screenshot_path,
+                        html_path=result.html_path,
+                        text_path=result.text_path,
+                        pdf_path=result.pdf_path,
+                        content_hash=result.content_hash,
+                        status=result.status_code,
+                        size_bytes=result.size_bytes,
+                        metadata=result.metadata
+                    )
+                    
+                    snapshot_id = snapshot.save(self.db)
+                    logger.info(f"Created snapshot {snapshot_id} for archive {archive.id}")
+                    
+                    # Check for changes
+                    diff_jobs = self._process_changes(archive, snapshot, previous_snapshot)
                 
-                # Check for changes
-                self._process_changes(archive, snapshot)
+                # Only announce the diff once the snapshot it refers to is committed
+                self._push_jobs('archive:diff', diff_jobs)
                 
                 return True
             else:
@@ -113,21 +263,18 @@ class CrawlerManager:
             logger.exception(f"Error crawling {archive.domain}: {str(e)}")
             return False
         finally:
-            self.active_crawls.remove(archive.id)
+            with self._active_lock:
+                self.active_crawls.discard(archive.id)
     
-    def _process_changes(self, archive, new_snapshot):
-        """Check for changes between the new snapshot and the previous one"""
-        # Get the previous snapshot
-        previous_snapshot = Snapshot.get_latest_for_archive(self.db, archive.id)
+    def _process_changes(self, archive, new_snapshot, previous_snapshot):
+        """Check for changes between the new snapshot and the previous one.
         
+        Queues the diff in the database and returns the diff jobs still to be
+        pushed to Redis.
+        """
         # If this is the first snapshot, no changes to detect
         if not previous_snapshot or previous_snapshot.id == new_snapshot.id:
-            return
-        
-        # Compare content hashes
-        if previous_snapshot.content_hash == new_snapshot.content_hash:
-            logger.info(f"No changes detected for {archive.domain}")
-            return
+            return []
         
         # Content has changed, update last_changed_at
         archive.update_change_time(self.db)
@@ -139,18 +286,8 @@ class CrawlerManager:
             'new_snapshot_id': new_snapshot.id
         }
         
-        # Add to Redis queue
-        queue_name = 'archive:diff'
-        job_id = self.redis.enqueue_job(queue_name, job_data, priority=3)
-        logger.debug(f"Added diff job {job_id} to queue {queue_name}")
-        
-        # Add to database queue
-        self.db.insert('archive_queue', {
-            'archive_id': archive.id,
-            'operation': 'diff',
-            'status': 'pending',
-            'priority': 3,
-            'scheduled_for': datetime.now()
-        })
+        jobs = [(archive, 3, job_data)]
+        self._insert_queue_rows('diff', jobs)
         
         logger.info(f"Changes detected for {archive.domain}, queued diff generation")
+        return jobs
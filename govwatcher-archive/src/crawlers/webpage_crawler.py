@@ -1,3 +1,6 @@
+import atexit
+import base64
+import functools
 import logging
 import os
 import tempfile
@@ -5,12 +8,36 @@ import requests
 import time
 from urllib.parse import urlparse
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.chrome.options import Options
-from bs4 import BeautifulSoup
+from selenium.webdriver.support.ui import WebDriverWait
 from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+from utils.hashing import ContentHasher
+from utils.html_text import html_to_text
 
 logger = logging.getLogger('govwatcher-archive.crawlers.webpage')
 
+# Only advertise brotli when urllib3 is able to decode it
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+_CHROME_BASE_ARGS = ('--headless', '--disable-gpu', '--no-sandbox', '--disable-dev-shm-usage')
+
+@functools.lru_cache(maxsize=1)
+def _build_options(user_agent):
+    """Build the headless Chrome options for a user agent"""
+    options = Options()
+    for arg in _CHROME_BASE_ARGS:
+        options.add_argument(arg)
+    options.add_argument(f'--user-agent={user_agent}')
+    return options
+
 @dataclass
 class CrawlResult:
     """Result of a webpage crawl"""
@@ -25,6 +52,7 @@ class CrawlResult:
     size_bytes: int = None
     error: str = None
     metadata: dict = None
+    not_modified: bool = False
 
 class WebpageCrawler:
     """Crawls webpages and captures content"""
@@ -33,14 +61,42 @@ class WebpageCrawler:
         self.config = config
         self.session = requests.Session()
         self.session.headers.update({
-            'User-Agent': config.CRAWLER_USER_AGENT
+            'User-Agent': config.CRAWLER_USER_AGENT,
+            'Accept-Encoding': ACCEPT_ENCODING
         })
+        
+        # Keep connections alive across crawls of hosts seen before
+        adapter = HTTPAdapter(pool_connections=64, pool_maxsize=64)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # Headless browser shared by every crawl, started on first use
+        self._browser = None
+        atexit.register(self.close)
+    
+    def close(self):
+        """Shut down the shared headless browser"""
+        if self._browser:
+            try:
+                self._browser.quit()
+            except Exception as e:
+                logger.warning(f"Error shutting down browser: {str(e)}")
+            self._browser = None
     
-    def crawl(self, domain):
-        """Crawl a domain and return results"""
+    def crawl(self, domain, if_none_match=None, if_modified_since=None):
+        """Crawl a domain and return results.
+        
+        When validators from a previous capture are given the request is made
+        conditional, and an unchanged page comes back with not_modified set.
+        """
         url = f"https://{domain}"
         logger.info(f"Crawling {url}")
         
+        # Config is immutable, so capture the values used below once per crawl
+        crawl_timeout = self.config.CRAWL_TIMEOUT
+        enable_screenshots = self.config.ENABLE_SCREENSHOTS
+        enable_pdf = self.config.ENABLE_PDF
+        
         result = CrawlResult(success=False)
         result.metadata = {
             'url': url,
@@ -49,68 +105,83 @@ class WebpageCrawler:
         }
         
         try:
-            # Fetch the page
-            response = self.session.get(url, timeout=self.config.CRAWL_TIMEOUT)
-            result.status_code = response.status_code
-            result.metadata['final_url'] = response.url
+            # Fetch the page, conditionally if we have validators
+            headers = {}
+            if if_none_match:
+                headers['If-None-Match'] = if_none_match
+            if if_modified_since:
+                headers['If-Modified-Since'] = if_modified_since
             
-            # Check if successful
-            if response.status_code != 200:
-                result.error = f"HTTP status code: {response.status_code}"
-                return result
-            
-            # Store HTML content
-            html_content = response.text
-            
-            # Store content in temp files
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # Save HTML
-                html_file = os.path.join(temp_dir, 'content.html')
-                with open(html_file, 'w', encoding='utf-8') as f:
-                    f.write(html_content)
-                
-                # Extract text
-                soup = BeautifulSoup(html_content, 'html.parser')
-                text_content = soup.get_text(separator='\n', strip=True)
-                text_file = os.path.join(temp_dir, 'content.txt')
-                with open(text_file, 'w', encoding='utf-8') as f:
-                    f.write(text_content)
+            # Stream the body so large pages are never held in memory whole
+            with self.session.get(url, timeout=crawl_timeout, headers=headers, stream=True) as response:
+                result.status_code = response.status_code
+                result.metadata['final_url'] = response.url
                 
-                # Take screenshot if enabled
-                screenshot_file = None
-                if self.config.ENABLE_SCREENSHOTS:
-                    screenshot_file = self._take_screenshot(url, temp_dir)
-                    result.metadata['screenshot_taken'] = bool(screenshot_file)
+                # Unchanged since the previous capture, nothing else to fetch
+                if response.status_code == 304:
+                    result.not_modified = True
+                    result.success = True
+                    return result
                 
-                # Generate PDF if enabled
-                pdf_file = None
-                if self.config.ENABLE_PDF:
-                    pdf_file = self._generate_pdf(url, temp_dir)
-                    result.metadata['pdf_generated'] = bool(pdf_file)
+                # Keep validators for the next conditional request
+                if response.headers.get('ETag'):
+                    result.metadata['etag'] = response.headers['ETag']
+                if response.headers.get('Last-Modified'):
+                    result.metadata['last_modified'] = response.headers['Last-Modified']
                 
-                # Generate WARC
-                warc_file = self._generate_warc(url, response, temp_dir)
+                # Check if successful
+                if response.status_code != 200:
+                    result.error = f"HTTP status code: {response.status_code}"
+                    return result
                 
-                # These would be stored by the storage manager when saving a snapshot
-                result.html_path = html_file
-                result.text_path = text_file
-                result.screenshot_path = screenshot_file
-                result.pdf_path = pdf_file
-                result.warc_path = warc_file
+                # Store content in temp files
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    # Stream the HTML to disk, hashing it chunk by chunk
+                    html_file = os.path.join(temp_dir, 'content.html')
+                    hasher = ContentHasher(self.config.HASH_ALGO)
+                    size_bytes = 0
+                    with open(html_file, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=65536):
+                            f.write(chunk)
+                            hasher.update(chunk)
+                            size_bytes += len(chunk)
+                    
+                    # Extract text
+                    with open(html_file, 'rb') as f:
+                        text_content = html_to_text(f.read(), response.encoding)
+                    text_file = os.path.join(temp_dir, 'content.txt')
+                    with open(text_file, 'w', encoding='utf-8') as f:
+                        f.write(text_content)
+                    
+                    # Render the page once for the screenshot and PDF if enabled
+                    screenshot_file = None
+                    pdf_file = None
+                    if (enable_screenshots or enable_pdf) and self._load_page(url):
+                        if enable_screenshots:
+                            screenshot_file = self._take_screenshot(url, temp_dir)
+                            result.metadata['screenshot_taken'] = bool(screenshot_file)
+                        
+                        if enable_pdf:
+                            pdf_file = self._generate_pdf(url, temp_dir)
+                            result.metadata['pdf_generated'] = bool(pdf_file)
+                    
+                    # Generate WARC
+                    warc_file = self._generate_warc(url, response, html_file, temp_dir)
+                    
+                    # These would be stored by the storage manager when saving a snapshot
+                    result.html_path = html_file
+                    result.text_path = text_file
+                    result.screenshot_path = screenshot_file
+                    result.pdf_path = pdf_file
+                    result.warc_path = warc_file
+                    
+                    result.content_hash = hasher.hexdigest()
+                    result.size_bytes = size_bytes
+                    
+                    # Mark as successful
+                    result.success = True
                 
-                # Calculate hash from HTML content
-                import hashlib
-                hasher = hashlib.sha256()
-                hasher.update(html_content.encode('utf-8'))
-                result.content_hash = hasher.hexdigest()
-                
-                # Set size (approximate)
-                result.size_bytes = len(html_content)
-                
-                # Mark as successful
-                result.success = True
-            
-            return result
+                return result
             
         except requests.RequestException as e:
             result.error = f"Request error: {str(e)}"
@@ -121,77 +192,82 @@ class WebpageCrawler:
             logger.exception(f"Unexpected error crawling {url}: {str(e)}")
             return result
     
-    def _take_screenshot(self, url, temp_dir):
-        """Take a screenshot of the webpage"""
-        screenshot_file = os.path.join(temp_dir, 'screenshot.png')
+    def _get_browser(self):
+        """Get the shared headless browser, starting it if needed"""
+        if self._browser is None:
+            options = _build_options(self.config.CRAWLER_USER_AGENT)
+            self._browser = webdriver.Chrome(options=options)
+            self._browser.set_window_size(1280, 1024)
         
+        return self._browser
+    
+    def _load_page(self, url):
+        """Navigate the shared browser to the webpage"""
         try:
-            options = Options()
-            options.add_argument('--headless')
-            options.add_argument('--disable-gpu')
-            options.add_argument('--no-sandbox')
-            options.add_argument('--disable-dev-shm-usage')
-            options.add_argument(f'--user-agent={self.config.CRAWLER_USER_AGENT}')
-            
-            browser = webdriver.Chrome(options=options)
-            browser.set_window_size(1280, 1024)
-            
+            browser = self._get_browser()
             browser.get(url)
-            time.sleep(3)  # Wait for page to load
             
-            # Take screenshot
-            browser.save_screenshot(screenshot_file)
-            browser.quit()
+            # Wait for the page to finish loading
+            try:
+                WebDriverWait(browser, self.config.SELENIUM_MAX_WAIT).until(
+                    lambda d: d.execute_script('return document.readyState') == 'complete'
+                )
+            except TimeoutException:
+                logger.warning(f"{url} still loading after {self.config.SELENIUM_MAX_WAIT}s, capturing anyway")
             
+            return True
+        except Exception as e:
+            logger.exception(f"Error loading {url} in browser: {str(e)}")
+            # The browser may be in a bad state, start a fresh one next time
+            self.close()
+            return False
+    
+    def _take_screenshot(self, url, temp_dir):
+        """Take a screenshot of the webpage loaded in the browser"""
+        screenshot_file = os.path.join(temp_dir, 'screenshot.png')
+        
+        try:
+            self._browser.save_screenshot(screenshot_file)
             return screenshot_file
         except Exception as e:
             logger.exception(f"Error taking screenshot of {url}: {str(e)}")
             return None
     
     def _generate_pdf(self, url, temp_dir):
-        """Generate a PDF of the webpage"""
+        """Generate a PDF of the webpage loaded in the browser"""
         pdf_file = os.path.join(temp_dir, 'content.pdf')
         
         try:
-            options = Options()
-            options.add_argument('--headless')
-            options.add_argument('--disable-gpu')
-            options.add_argument('--no-sandbox')
-            options.add_argument('--disable-dev-shm-usage')
-            options.add_argument(f'--user-agent={self.config.CRAWLER_USER_AGENT}')
-            options.add_argument('--print-to-pdf=' + pdf_file)
-            
-            browser = webdriver.Chrome(options=options)
-            browser.get(url)
-            time.sleep(3)  # Wait for page to load
-            browser.quit()
+            pdf = self._browser.execute_cdp_cmd('Page.printToPDF', {'printBackground': True})
+            with open(pdf_file, 'wb') as f:
+                f.write(base64.b64decode(pdf['data']))
             
             return pdf_file
         except Exception as e:
             logger.exception(f"Error generating PDF of {url}: {str(e)}")
             return None
     
-    def _generate_warc(self, url, response, temp_dir):
-        """Generate a WARC file for the webpage"""
+    def _generate_warc(self, url, response, html_file, temp_dir):
+        """Generate a gzipped WARC file for the webpage from its saved body"""
         try:
-            # Simple placeholder implementation - in a real system you'd use
-            # a dedicated WARC tool like warcio
-            warc_file = os.path.join(temp_dir, 'original.warc')
+            warc_file = os.path.join(temp_dir, 'original.warc.gz')
+            
+            # The payload is stored decoded, so drop headers describing the wire encoding
+            headers_list = [
+                (key, value) for key, value in response.headers.items()
+                if key.lower() not in ('content-encoding', 'transfer-encoding', 'content-length')
+            ]
+            headers_list.append(('Content-Length', str(os.path.getsize(html_file))))
+            http_headers = StatusAndHeaders(
+                f"{response.status_code} {response.reason}", headers_list, protocol='HTTP/1.1'
+            )
             
-            with open(warc_file, 'w', encoding='utf-8') as f:
-                f.write(f"WARC/1.0\r\n")
-                f.write(f"WARC-Type: response\r\n")
-                f.write(f"WARC-Target-URI: {url}\r\n")
-                f.write(f"WARC-Date: {time.strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n")
-                f.write(f"WARC-Record-ID: <urn:uuid:{os.urandom(16).hex()}>\r\n")
-                f.write(f"Content-Type: application/http; msgtype=response\r\n")
-                f.write(f"Content-Length: {len(response.content)}\r\n")
-                f.write(f"\r\n")
-                f.write(f"HTTP/1.1 {response.status_code} {response.reason}\r\n")
-                for key, value in response.headers.items():
-                    f.write(f"{key}: {value}\r\n")
-                f.write(f"\r\n")
-                f.write(response.text)
+            with open(warc_file, 'wb') as f, open(html_file, 'rb') as payload:
+                writer = WARCWriter(f, gzip=True)
+                record = writer.create_warc_record(
+                    url, 'response', payload=payload, http_headers=http_headers
+                )
+                writer.write_record(record)
             
             return warc_file
         except Exception as e:
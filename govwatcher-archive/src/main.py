@@ -3,13 +3,13 @@
 GovWatcher Archiving System
 Main entry point for the application.
 """
-import os
 import sys
 import logging
 import argparse
+import functools
+import shlex
 import signal
 import time
-from dotenv import load_dotenv
 
 # Set up logging
 logging.basicConfig(
@@ -23,7 +23,7 @@ logger = logging.getLogger('govwatcher-archive')
 
 # Import project modules
 try:
-    from config import Config
+    from config import get_config
     from crawlers import CrawlerManager
     from processors import DiffProcessor
     from storage import StorageManager
@@ -40,31 +40,30 @@ def signal_handler(sig, frame):
     logger.info("Shutdown signal received, exiting gracefully...")
     sys.exit(0)
 
+@functools.lru_cache(maxsize=1)
 def setup():
-    """Initialize the application"""
-    # Load environment variables
-    load_dotenv()
-    
+    """Initialize the application (once per process)"""
     # Set up signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
     # Initialize configuration
-    config = Config()
+    config = get_config()
     
     # Initialize connections
     try:
         db = Database(
-            host=os.getenv('DB_HOST', 'db'),
-            port=int(os.getenv('DB_PORT', '5432')),
-            database=os.getenv('DB_NAME', 'govwatcher'),
-            user=os.getenv('DB_USER', 'archive_admin'),
-            password=os.getenv('DB_PASSWORD')
+            host=config.DB_HOST,
+            port=config.DB_PORT,
+            database=config.DB_NAME,
+            user=config.DB_USER,
+            password=config.DB_PASSWORD,
+            maxconn=config.DB_MAX_CONNS
         )
         redis_client = RedisClient(
-            host=os.getenv('REDIS_HOST', 'redis'),
-            port=int(os.getenv('REDIS_PORT', '6379')),
-            password=os.getenv('REDIS_PASSWORD')
+            host=config.REDIS_HOST,
+            port=config.REDIS_PORT,
+            password=config.REDIS_PASSWORD
         )
         logger.info("Database and Redis connections established")
     except Exception as e:
@@ -99,11 +98,13 @@ def run_server(config, db, redis_client, crawler_manager, diff_processor, storag
         raise
     finally:
         logger.info("Server shutting down")
+        crawler_manager.shutdown()
+        diff_processor.shutdown()
         db.close()
         redis_client.close()
 
 def run_single_task(args, config, db, redis_client, crawler_manager, diff_processor, storage_manager):
-    """Run a single task and exit"""
+    """Run a single task"""
     if args.cmd == 'crawl':
         if args.domain:
             logger.info(f"Running single crawl for domain: {args.domain}")
@@ -129,12 +130,34 @@ def run_single_task(args, config, db, redis_client, crawler_manager, diff_proces
             import_domains(db, args.file, args.priority_file)
         else:
             logger.error("File required for import command")
-    
-    db.close()
-    redis_client.close()
 
-def main():
-    """Main entry point"""
+def run_shell(parser, config, db, redis_client, crawler_manager, diff_processor, storage_manager):
+    """Run commands read line by line from stdin, reusing the same connections"""
+    logger.info("Reading commands from stdin...")
+    
+    for line in sys.stdin:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        
+        try:
+            args = parser.parse_args(shlex.split(line))
+        except SystemExit:
+            # argparse has already printed the usage error
+            continue
+        
+        if args.cmd in (None, 'server', 'shell'):
+            logger.error(f"Command not available in shell mode: {line}")
+            continue
+        
+        try:
+            run_single_task(args, config, db, redis_client, crawler_manager, diff_processor, storage_manager)
+        except Exception as e:
+            logger.exception(f"Error running command '{line}': {e}")
+
+@functools.lru_cache(maxsize=1)
+def build_parser():
+    """Build the command line parser"""
     parser = argparse.ArgumentParser(description='GovWatcher Archiving System')
     parser.add_argument('--debug', action='store_true', help='Enable debug logging')
     
@@ -159,6 +182,14 @@ def main():
     import_parser.add_argument('--file', type=str, help='Path to CSV file')
     import_parser.add_argument('--priority-file', type=str, help='Path to priority CSV file')
     
+    # Shell command
+    subparsers.add_parser('shell', help='Run crawl/diff/import commands read from stdin')
+    
+    return parser
+
+def main():
+    """Main entry point"""
+    parser = build_parser()
     args = parser.parse_args()
     
     # Set log level
@@ -172,8 +203,18 @@ def main():
     # Run selected command
     if args.cmd == 'server' or not args.cmd:
         run_server(config, db, redis_client, crawler_manager, diff_processor, storage_manager)
-    else:
-        run_single_task(args, config, db, redis_client, crawler_manager, diff_processor, storage_manager)
+        return
+    
+    try:
+        if args.cmd == 'shell':
+            run_shell(parser, config, db, redis_client, crawler_manager, diff_processor, storage_manager)
+        else:
+            run_single_task(args, config, db, redis_client, crawler_manager, diff_processor, storage_manager)
+    finally:
+        crawler_manager.shutdown()
+        diff_processor.shutdown()
+        db.close()
+        redis_client.close()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
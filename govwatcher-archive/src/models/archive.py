@@ -1,15 +1,27 @@
 import logging
 from datetime import datetime
+from typing import Optional
+import orjson
 
 logger = logging.getLogger('govwatcher-archive.models.archive')
 
+# Columns of the archives table, in order; also the instance slots
+ARCHIVE_FIELDS = ('id', 'domain', 'domain_type', 'agency', 'organization_name', 'city',
+                  'state', 'security_contact_email', 'priority', 'created_at',
+                  'last_checked_at', 'last_changed_at', 'enabled')
+
 class Archive:
     """Represents a monitored website in the system"""
     
-    def __init__(self, id=None, domain=None, domain_type=None, agency=None, 
-                 organization_name=None, city=None, state=None, 
-                 security_contact_email=None, priority=3, created_at=None, 
-                 last_checked_at=None, last_changed_at=None, enabled=True):
+    __slots__ = ARCHIVE_FIELDS
+    
+    def __init__(self, id: Optional[int] = None, domain: Optional[str] = None,
+                 domain_type: Optional[str] = None, agency: Optional[str] = None,
+                 organization_name: Optional[str] = None, city: Optional[str] = None,
+                 state: Optional[str] = None, security_contact_email: Optional[str] = None,
+                 priority: int = 3, created_at: Optional[datetime] = None,
+                 last_checked_at: Optional[datetime] = None,
+                 last_changed_at: Optional[datetime] = None, enabled: bool = True):
         self.id = id
         self.domain = domain
         self.domain_type = domain_type
@@ -31,13 +43,13 @@ class Archive:
     
     @classmethod
     def from_row(cls, row):
-        """Create an Archive instance from a database row"""
-        return cls(**dict(row))
+        """Create an Archive instance from a full archives row, ignoring columns that aren't fields"""
+        return cls(*[row[field] for field in ARCHIVE_FIELDS])
     
     @classmethod
     def get_by_id(cls, db, archive_id):
         """Get an archive by ID"""
-        row = db.query_one("SELECT * FROM archives WHERE id = %s", (archive_id,))
+        row = db.query_one_prepared('archive_by_id', "SELECT * FROM archives WHERE id = $1", (archive_id,))
         if row:
             return cls.from_row(row)
         return None
@@ -73,17 +85,37 @@ class Archive:
         return [cls.from_row(row) for row in rows]
     
     @classmethod
-    def get_pending(cls, db, max_records=10):
-        """Get archives that need to be checked based on priority and last check time"""
+    def get_pending(cls, db, max_records=10, buckets=(1, 3),
+                    intervals=(7 * 24 * 3600, 14 * 24 * 3600, 30 * 24 * 3600)):
+        """Get archives that need to be checked based on priority and last check time.
+        
+        An archive is due once its check interval has passed, intervals[i] seconds
+        for priorities at or below buckets[i] and intervals[-1] above them all.
+        The returned rows are locked (skipping rows other workers hold) until the
+        caller's transaction ends, so call this inside db.transaction().
+        """
+        high, normal = buckets
+        high_interval, normal_interval, low_interval = intervals
         query = """
             SELECT a.* FROM archives a
-            LEFT JOIN archive_queue q ON a.id = q.archive_id AND q.status IN ('pending', 'in_progress')
             WHERE a.enabled = TRUE
-            AND q.id IS NULL
+            AND (
+                a.last_checked_at IS NULL
+                OR a.last_checked_at <= NOW() - INTERVAL '1 second' * CASE
+                    WHEN a.priority <= %s THEN %s
+                    WHEN a.priority <= %s THEN %s
+                    ELSE %s
+                END
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM archive_queue q
+                WHERE q.archive_id = a.id AND q.status IN ('pending', 'in_progress')
+            )
             ORDER BY a.priority ASC, a.last_checked_at ASC NULLS FIRST
             LIMIT %s
+            FOR UPDATE OF a SKIP LOCKED
         """
-        rows = db.query_all(query, (max_records,))
+        rows = db.query_all(query, (high, high_interval, normal, normal_interval, low_interval, max_records))
         return [cls.from_row(row) for row in rows]
     
     def save(self, db):
@@ -157,3 +189,7 @@ class Archive:
             'last_changed_at': self.last_changed_at.isoformat() if self.last_changed_at else None,
             'enabled': self.enabled
         }
+    
+    def to_json(self):
+        """Serialize to JSON bytes (same fields as to_dict, datetimes encoded by orjson)"""
+        return orjson.dumps({field: getattr(self, field) for field in ARCHIVE_FIELDS})
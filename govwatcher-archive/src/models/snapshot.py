@@ -1,17 +1,28 @@
 import logging
 from datetime import datetime
-import hashlib
-import json
+from typing import Optional
+from utils.hashing import ContentHasher, hash_file
+from utils.serialization import dumps, loads
 
 logger = logging.getLogger('govwatcher-archive.models.snapshot')
 
+# Columns of the snapshots table, in order; also the instance slots
+SNAPSHOT_FIELDS = ('id', 'archive_id', 'capture_timestamp', 'warc_path', 'screenshot_path',
+                   'html_path', 'text_path', 'pdf_path', 'content_hash', 'status',
+                   'size_bytes', 'error_message', 'metadata')
+
 class Snapshot:
     """Represents a captured snapshot of a website"""
     
-    def __init__(self, id=None, archive_id=None, capture_timestamp=None, warc_path=None, 
-                 screenshot_path=None, html_path=None, text_path=None, pdf_path=None, 
-                 content_hash=None, status=None, size_bytes=None, error_message=None, 
-                 metadata=None):
+    __slots__ = SNAPSHOT_FIELDS
+    
+    def __init__(self, id: Optional[int] = None, archive_id: Optional[int] = None,
+                 capture_timestamp: Optional[datetime] = None, warc_path: Optional[str] = None,
+                 screenshot_path: Optional[str] = None, html_path: Optional[str] = None,
+                 text_path: Optional[str] = None, pdf_path: Optional[str] = None,
+                 content_hash: Optional[str] = None, status: Optional[int] = None,
+                 size_bytes: Optional[int] = None, error_message: Optional[str] = None,
+                 metadata: Optional[dict] = None):
         self.id = id
         self.archive_id = archive_id
         self.capture_timestamp = capture_timestamp or datetime.now()
@@ -30,21 +41,22 @@ class Snapshot:
     def from_dict(cls, data):
         """Create a Snapshot instance from a dictionary"""
         if isinstance(data.get('metadata'), str):
-            data['metadata'] = json.loads(data['metadata'])
+            data['metadata'] = loads(data['metadata'])
         return cls(**data)
     
     @classmethod
     def from_row(cls, row):
-        """Create a Snapshot instance from a database row"""
-        data = dict(row)
+        """Create a Snapshot instance from a database row, ignoring columns that aren't fields"""
+        row = dict(row)
+        data = {field: row[field] for field in SNAPSHOT_FIELDS if field in row}
         if isinstance(data.get('metadata'), str):
-            data['metadata'] = json.loads(data['metadata'])
+            data['metadata'] = loads(data['metadata'])
         return cls(**data)
     
     @classmethod
     def get_by_id(cls, db, snapshot_id):
         """Get a snapshot by ID"""
-        row = db.query_one("SELECT * FROM snapshots WHERE id = %s", (snapshot_id,))
+        row = db.query_one_prepared('snapshot_by_id', "SELECT * FROM snapshots WHERE id = $1", (snapshot_id,))
         if row:
             return cls.from_row(row)
         return None
@@ -52,8 +64,9 @@ class Snapshot:
     @classmethod
     def get_latest_for_archive(cls, db, archive_id):
         """Get the latest snapshot for an archive"""
-        row = db.query_one(
-            "SELECT * FROM snapshots WHERE archive_id = %s ORDER BY capture_timestamp DESC LIMIT 1", 
+        row = db.query_one_prepared(
+            'snapshot_latest_for_archive',
+            "SELECT * FROM snapshots WHERE archive_id = $1 ORDER BY capture_timestamp DESC LIMIT 1",
             (archive_id,)
         )
         if row:
@@ -85,7 +98,7 @@ class Snapshot:
                 'status': self.status,
                 'size_bytes': self.size_bytes,
                 'error_message': self.error_message,
-                'metadata': json.dumps(self.metadata) if self.metadata else None
+                'metadata': dumps(self.metadata).decode('utf-8') if self.metadata else None
             }
             db.update('snapshots', data, 'id = %(id)s', {'id': self.id})
             return self.id
@@ -103,18 +116,29 @@ class Snapshot:
                 'status': self.status,
                 'size_bytes': self.size_bytes,
                 'error_message': self.error_message,
-                'metadata': json.dumps(self.metadata) if self.metadata else None
+                'metadata': dumps(self.metadata).decode('utf-8') if self.metadata else None
             }
             self.id = db.insert('snapshots', data)
             return self.id
     
-    def calculate_content_hash(self, content):
-        """Calculate a hash of the content"""
-        hasher = hashlib.sha256()
+    def calculate_content_hash(self, content=None, path=None, algo=None, chunk=1 << 20):
+        """Calculate a hash of the content, a file path or an iterable of chunks.
+        
+        algo defaults to config.HASH_ALGO, matching the hashes written by storage.
+        """
+        if path is not None:
+            # Stream the file so large pages are never held in memory twice
+            self.content_hash = hash_file(path, algo, chunk)
+            return self.content_hash
+        
+        hasher = ContentHasher(algo)
         if isinstance(content, str):
             hasher.update(content.encode('utf-8'))
-        else:
+        elif isinstance(content, (bytes, bytearray, memoryview)):
             hasher.update(content)
+        else:
+            for block in content:
+                hasher.update(block.encode('utf-8') if isinstance(block, str) else block)
         self.content_hash = hasher.hexdigest()
         return self.content_hash
     
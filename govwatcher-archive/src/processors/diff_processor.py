@@ -1,14 +1,70 @@
+import array
 import logging
-import json
+import math
+import multiprocessing
 import os
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
 from datetime import datetime
-from difflib import SequenceMatcher
 from models.snapshot import Snapshot
 from models.archive import Archive
+from processors.myers import myers_diff
+from storage.storage_manager import DIFF_FORMAT, StorageManager
+from utils.db import Database
+from utils.serialization import dumps
 
 logger = logging.getLogger('govwatcher-archive.processors.diff')
 
+# Screenshots larger than this are downscaled before the visual diff
+VISUAL_DIFF_MAX_PIXELS = 2_000_000
+
+def _decode_line(line):
+    """Decode a raw content line for the diff output"""
+    return line.decode('utf-8', 'replace')
+
+# DiffProcessor owned by a pool worker process, set up by _init_diff_worker
+_worker_processor = None
+
+def _init_diff_worker(config):
+    """Give the worker process its own database connection and storage manager"""
+    global _worker_processor
+    db = Database(
+        host=config.DB_HOST,
+        port=config.DB_PORT,
+        database=config.DB_NAME,
+        user=config.DB_USER,
+        password=config.DB_PASSWORD,
+        maxconn=2
+    )
+    # Several workers compress at once, so each keeps zstd to its own thread
+    _worker_processor = DiffProcessor(config, db, StorageManager(config, db, zstd_threads=0))
+
+def _run_diff_job(archive_id, old_snapshot_id, new_snapshot_id):
+    """Generate a single diff inside a pool worker process"""
+    return _worker_processor.generate_diff(archive_id, old_snapshot_id, new_snapshot_id)
+
+def _make_hunk(old_start, old_count, new_start, new_count, types, contents, old_nums, new_nums):
+    """Build a hunk whose changes are stored as parallel columns.
+    
+    StorageManager.load_diff zips the columns back into react-diff-view change objects,
+    and rebuilds the "@@ -oldStart,oldLines +newStart,newLines @@" header, which
+    isn't stored, from the numeric fields.
+    """
+    return {
+        'oldStart': old_start,
+        'oldLines': old_count,
+        'newStart': new_start,
+        'newLines': new_count,
+        'changes': {
+            'types': ''.join(types),
+            'contents': contents,
+            'oldLine': old_nums,
+            'newLine': new_nums
+        }
+    }
+
 class DiffProcessor:
     """Processes diffs between snapshots"""
     
@@ -16,54 +72,93 @@ class DiffProcessor:
         self.config = config
         self.db = db
         self.storage = storage_manager
+        self._pool = None  # Created on first use, diffs are CPU bound so they run in processes
+    
+    def shutdown(self, wait=True):
+        """Stop the diff worker processes"""
+        if self._pool:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+    
+    def _get_pool(self):
+        """Get the diff worker pool, starting it on first use"""
+        if self._pool is None:
+            # Workers are started from a clean server process, forking this one would copy
+            # locks held by the crawler and database threads into the children
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.config.MAX_DIFF_WORKERS,
+                mp_context=multiprocessing.get_context('forkserver'),
+                initializer=_init_diff_worker,
+                initargs=(self.config,)
+            )
+        return self._pool
     
     def process_pending_diffs(self):
         """Process diffs that are in the queue"""
-        # Find pending diff jobs
+        # Claim a batch of pending diff jobs in one round trip, one per worker
+        query = """
+            UPDATE archive_queue
+            SET status = 'in_progress', started_at = now()
+            WHERE id IN (
+                SELECT id FROM archive_queue
+                WHERE operation = 'diff' AND status = 'pending'
+                ORDER BY priority ASC, scheduled_for ASC
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, archive_id
+        """
+        jobs = self.db.query_all(query, (self.config.MAX_DIFF_WORKERS,), commit=True)
+        if not jobs:
+            return
+        
+        # Get the latest two snapshots of every claimed archive at once
         query = """
-            SELECT * FROM archive_queue 
-            WHERE operation = 'diff' AND status = 'pending'
-            ORDER BY priority ASC, scheduled_for ASC
-            LIMIT 5
+            SELECT archive_id, id, rn FROM (
+                SELECT archive_id, id,
+                       row_number() OVER (PARTITION BY archive_id ORDER BY capture_timestamp DESC) AS rn
+                FROM snapshots
+                WHERE archive_id = ANY(%s)
+            ) latest
+            WHERE rn <= 2
         """
-        jobs = self.db.query_all(query)
+        latest = {}
+        for row in self.db.query_all(query, (list({job['archive_id'] for job in jobs}),)):
+            latest.setdefault(row['archive_id'], {})[row['rn']] = row['id']
         
+        # Generate the diffs in parallel, each job is independent
+        pool = self._get_pool()
+        futures = {}
+        for job in jobs:
+            snapshots = latest.get(job['archive_id'], {})
+            if 1 in snapshots and 2 in snapshots:
+                futures[job['id']] = pool.submit(_run_diff_job, job['archive_id'], snapshots[2], snapshots[1])
+        
+        results = []
         for job in jobs:
-            # Mark job as in progress
-            self.db.update('archive_queue', 
-                          {'status': 'in_progress', 'started_at': datetime.now()}, 
-                          'id = %(id)s', 
-                          {'id': job['id']})
-            
             try:
-                # Get the latest snapshots for this archive
-                query = """
-                    SELECT old.id as old_id, new.id as new_id
-                    FROM snapshots new
-                    JOIN snapshots old ON old.archive_id = new.archive_id
-                    WHERE new.archive_id = %s
-                    ORDER BY new.capture_timestamp DESC
-                    LIMIT 2
-                """
-                snapshots = self.db.query_one(query, (job['archive_id'],))
+                future = futures.get(job['id'])
+                if future:
+                    future.result()
                 
-                if snapshots and snapshots['old_id'] != snapshots['new_id']:
-                    # Generate diff between the two snapshots
-                    self.generate_diff(job['archive_id'], snapshots['old_id'], snapshots['new_id'])
+                results.append((job['id'], 'completed', None))
                 
-                # Mark job as completed
-                self.db.update('archive_queue', 
-                              {'status': 'completed', 'completed_at': datetime.now()}, 
-                              'id = %(id)s', 
-                              {'id': job['id']})
-                              
             except Exception as e:
                 logger.exception(f"Error processing diff job {job['id']}: {str(e)}")
-                # Mark job as failed
-                self.db.update('archive_queue', 
-                              {'status': 'failed', 'error_message': str(e)}, 
-                              'id = %(id)s', 
-                              {'id': job['id']})
+                results.append((job['id'], 'failed', str(e)))
+                if isinstance(e, BrokenProcessPool):
+                    # A worker died, start a fresh pool on the next run
+                    self._pool = None
+        
+        # Mark every job completed or failed in a single statement
+        self.db.execute_values("""
+            UPDATE archive_queue q
+            SET status = v.status,
+                completed_at = CASE WHEN v.status = 'completed' THEN now() ELSE q.completed_at END,
+                error_message = COALESCE(v.error_message, q.error_message)
+            FROM (VALUES %s) AS v(id, status, error_message)
+            WHERE q.id = v.id
+        """, results)
     
     def generate_diff(self, archive_id, old_snapshot_id, new_snapshot_id):
         """Generate a diff between two snapshots"""
@@ -77,12 +172,17 @@ class DiffProcessor:
             logger.error(f"Couldn't find snapshots to diff: {old_snapshot_id}, {new_snapshot_id}")
             return None
         
-        # Check if diff already exists
+        # Check if diff already exists, before any of the work to compute it
         diff_exists = self._check_diff_exists(old_snapshot_id, new_snapshot_id)
         if diff_exists:
             logger.info(f"Diff already exists between {old_snapshot_id} and {new_snapshot_id}")
             return diff_exists
         
+        # Identical content hashes mean there is nothing to diff
+        if old_snapshot.content_hash and old_snapshot.content_hash == new_snapshot.content_hash:
+            logger.info(f"Snapshots {old_snapshot_id} and {new_snapshot_id} have the same content, skipping diff")
+            return None
+        
         # Get content for both snapshots
         old_content = self._get_snapshot_content(old_snapshot)
         new_content = self._get_snapshot_content(new_snapshot)
@@ -91,28 +191,29 @@ class DiffProcessor:
             logger.error("Failed to get content for snapshots")
             return None
         
-        # Generate the diff
-        diff_data = self._generate_text_diff(old_content, new_content)
+        # Generate the diff and its statistics
+        diff_data, stats = self._generate_text_diff(old_content, new_content)
         
         # Store the diff
         diff_path = self.storage.store_diff(archive_id, old_snapshot_id, new_snapshot_id, diff_data)
         
-        # Calculate diff statistics
-        stats = self._calculate_diff_stats(diff_data)
-        
         # Determine significance
         significance = self._determine_significance(stats)
         
-        # Insert diff into database
+        # Insert diff into database, the unique snapshot pair makes this a no-op if another worker got there first
         diff_id = self.db.insert('diffs', {
             'archive_id': archive_id,
             'old_snapshot_id': old_snapshot_id,
             'new_snapshot_id': new_snapshot_id,
             'diff_timestamp': datetime.now(),
             'diff_path': diff_path,
-            'stats': json.dumps(stats),
+            'stats': dumps(stats).decode('utf-8'),
             'significance': significance
-        })
+        }, on_conflict='(old_snapshot_id, new_snapshot_id) DO NOTHING')
+        
+        if diff_id is None:
+            logger.info(f"Diff already exists between {old_snapshot_id} and {new_snapshot_id}")
+            return self._check_diff_exists(old_snapshot_id, new_snapshot_id)
         
         logger.info(f"Created diff {diff_id} with significance {significance}")
         
@@ -144,156 +245,113 @@ class DiffProcessor:
         return row['id'] if row else None
     
     def _get_snapshot_content(self, snapshot):
-        """Get the content for a snapshot, preferring HTML"""
-        if snapshot.html_path and os.path.exists(snapshot.html_path):
-            with open(snapshot.html_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        elif snapshot.text_path and os.path.exists(snapshot.text_path):
-            with open(snapshot.text_path, 'r', encoding='utf-8') as f:
-                return f.read()
+        """Get the raw content bytes for a snapshot, preferring HTML"""
+        for path in (snapshot.html_path, snapshot.text_path):
+            if not path:
+                continue
+            try:
+                return Path(path).read_bytes()
+            except OSError:
+                continue
         return None
     
     def _generate_text_diff(self, old_content, new_content):
-        """Generate a text-based diff using difflib"""
-        # Split content into lines
+        """Generate a text-based line diff, returns the diff data and its statistics"""
+        # Split the raw bytes into lines, only lines that end up in hunks get decoded
         old_lines = old_content.splitlines()
         new_lines = new_content.splitlines()
         
-        # Use SequenceMatcher to get opcodes
-        matcher = SequenceMatcher(None, old_lines, new_lines)
-        opcodes = matcher.get_opcodes()
+        # Intern each distinct line to an int id so the diff compares ints, not strings
+        line_ids = {}
+        old_ids = array.array('i', [line_ids.setdefault(line, len(line_ids)) for line in old_lines])
+        new_ids = array.array('i', [line_ids.setdefault(line, len(line_ids)) for line in new_lines])
         
-        # Format diff data for react-diff-view
+        # Myers diff gives SequenceMatcher-style opcodes in O(ND)
+        opcodes = myers_diff(old_ids, new_ids)
+        
+        # Format diff data for react-diff-view, with each hunk's changes stored column-wise:
+        # types holds one character per change (' ' context, '+' insert, '-' delete)
         hunks = []
-        hunk_changes = []
+        types, contents, old_nums, new_nums = [], [], [], []
         old_start = 1
         new_start = 1
         
+        # Statistics are counted while the hunks are built
+        additions = 0
+        deletions = 0
+        
         for tag, i1, i2, j1, j2 in opcodes:
             # Skip 'equal' sections if they're too large
             if tag == 'equal' and (i2 - i1) > 10:
                 # Only include 3 lines of context
                 # Add 3 lines of context at the start
                 for i in range(i1, min(i1 + 3, i2)):
-                    hunk_changes.append({
-                        'type': 'context',
-                        'content': old_lines[i],
-                        'oldLine': old_start + i - i1,
-                        'newLine': new_start + i - i1
-                    })
+                    types.append(' ')
+                    contents.append(_decode_line(old_lines[i]))
+                    old_nums.append(old_start + i - i1)
+                    new_nums.append(new_start + i - i1)
                 
                 # If we have a current hunk with changes, save it
-                if any(c['type'] != 'context' for c in hunk_changes):
+                if '+' in types or '-' in types:
                     old_count = i1 + 3 - old_start
                     new_count = j1 + 3 - new_start
                     
-                    hunks.append({
-                        'content': f"@@ -{old_start},{old_count} +{new_start},{new_count} @@",
-                        'oldStart': old_start,
-                        'oldLines': old_count,
-                        'newStart': new_start,
-                        'newLines': new_count,
-                        'changes': hunk_changes
-                    })
+                    hunks.append(_make_hunk(old_start, old_count, new_start, new_count,
+                                            types, contents, old_nums, new_nums))
                 
                 # Reset for next hunk
-                hunk_changes = []
+                types, contents, old_nums, new_nums = [], [], [], []
                 old_start = max(1, i2 - 3)
                 new_start = max(1, j2 - 3)
                 
                 # Add 3 lines of context at the end
                 for i in range(max(i1, i2 - 3), i2):
-                    hunk_changes.append({
-                        'type': 'context',
-                        'content': old_lines[i],
-                        'oldLine': old_start + i - max(i1, i2 - 3),
-                        'newLine': new_start + i - max(i1, i2 - 3)
-                    })
+                    types.append(' ')
+                    contents.append(_decode_line(old_lines[i]))
+                    old_nums.append(old_start + i - max(i1, i2 - 3))
+                    new_nums.append(new_start + i - max(i1, i2 - 3))
                 
                 continue
             
             # Process changes
-            if tag == 'replace':
-                # Deletion part
-                for i in range(i1, i2):
-                    hunk_changes.append({
-                        'type': 'delete',
-                        'content': '-' + old_lines[i],
-                        'oldLine': old_start + i - i1,
-                        'newLine': None
-                    })
-                # Addition part
-                for j in range(j1, j2):
-                    hunk_changes.append({
-                        'type': 'insert',
-                        'content': '+' + new_lines[j],
-                        'oldLine': None,
-                        'newLine': new_start + j - j1
-                    })
-            elif tag == 'delete':
+            if tag in ('replace', 'delete'):
+                deletions += i2 - i1
                 for i in range(i1, i2):
-                    hunk_changes.append({
-                        'type': 'delete',
-                        'content': '-' + old_lines[i],
-                        'oldLine': old_start + i - i1,
-                        'newLine': None
-                    })
-            elif tag == 'insert':
+                    types.append('-')
+                    contents.append('-' + _decode_line(old_lines[i]))
+                    old_nums.append(old_start + i - i1)
+                    new_nums.append(None)
+            if tag in ('replace', 'insert'):
+                additions += j2 - j1
                 for j in range(j1, j2):
-                    hunk_changes.append({
-                        'type': 'insert',
-                        'content': '+' + new_lines[j],
-                        'oldLine': None,
-                        'newLine': new_start + j - j1
-                    })
+                    types.append('+')
+                    contents.append('+' + _decode_line(new_lines[j]))
+                    old_nums.append(None)
+                    new_nums.append(new_start + j - j1)
             elif tag == 'equal':
                 for i in range(i1, i2):
-                    hunk_changes.append({
-                        'type': 'context',
-                        'content': ' ' + old_lines[i],
-                        'oldLine': old_start + i - i1,
-                        'newLine': new_start + j1 + i - i1
-                    })
+                    types.append(' ')
+                    contents.append(' ' + _decode_line(old_lines[i]))
+                    old_nums.append(old_start + i - i1)
+                    new_nums.append(new_start + j1 + i - i1)
         
         # Add the last hunk if there are changes
-        if hunk_changes:
+        if types:
             old_count = i2 - old_start
             new_count = j2 - new_start
             
-            hunks.append({
-                'content': f"@@ -{old_start},{old_count} +{new_start},{new_count} @@",
-                'oldStart': old_start,
-                'oldLines': old_count,
-                'newStart': new_start,
-                'newLines': new_count,
-                'changes': hunk_changes
-            })
+            hunks.append(_make_hunk(old_start, old_count, new_start, new_count,
+                                    types, contents, old_nums, new_nums))
         
-        # Convert to JSON-compatible dict
-        return {'hunks': hunks}
-    
-    def _calculate_diff_stats(self, diff_data):
-        """Calculate statistics about the diff"""
-        additions = 0
-        deletions = 0
-        changes = 0
-        
-        for hunk in diff_data.get('hunks', []):
-            for change in hunk.get('changes', []):
-                if change['type'] == 'insert':
-                    additions += 1
-                elif change['type'] == 'delete':
-                    deletions += 1
-                elif change['type'] == 'replace':
-                    changes += 1
-        
-        total_changes = additions + deletions + changes
-        return {
+        stats = {
             'additions': additions,
-            'deletions': deletions, 
-            'changes': changes,
-            'total': total_changes
+            'deletions': deletions,
+            'changes': 0,
+            'total': additions + deletions
         }
+        
+        # Convert to JSON-compatible dict, format tells readers the changes are column-wise
+        return {'format': DIFF_FORMAT, 'hunks': hunks}, stats
     
     def _determine_significance(self, stats):
         """Determine the significance of changes based on stats"""
@@ -312,9 +370,18 @@ class DiffProcessor:
             import cv2
             import numpy as np
             
-            # Read images
+            # Read images, each is decoded only once
             img1 = cv2.imread(old_screenshot)
             img2 = cv2.imread(new_screenshot)
+            if img1 is None or img2 is None:
+                logger.error(f"Couldn't read screenshots for {old_snapshot_id} and {new_snapshot_id}")
+                return None
+            
+            # Skip the full pipeline only when the screenshots are pixel-identical,
+            # a perceptual hash would also drop small real changes such as one edited line
+            if img1.shape == img2.shape and np.array_equal(img1, img2):
+                logger.info(f"Screenshots for {old_snapshot_id} and {new_snapshot_id} match, skipping visual diff")
+                return None
             
             # Make sure both images are the same size
             if img1.shape != img2.shape:
@@ -324,9 +391,18 @@ class DiffProcessor:
                 else:
                     img2 = cv2.resize(img2, (img1.shape[1], img1.shape[0]))
             
+            # Work on a downscaled copy of large screenshots, the threshold and dilation don't need full resolution
+            height, width = img2.shape[:2]
+            scale = min(1.0, math.sqrt(VISUAL_DIFF_MAX_PIXELS / (height * width)))
+            if scale < 1.0:
+                small1 = cv2.resize(img1, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                small2 = cv2.resize(img2, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            else:
+                small1, small2 = img1, img2
+            
             # Convert to grayscale
-            gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-            gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
+            gray1 = cv2.cvtColor(small1, cv2.COLOR_BGR2GRAY)
+            gray2 = cv2.cvtColor(small2, cv2.COLOR_BGR2GRAY)
             
             # Find the difference
             diff = cv2.absdiff(gray1, gray2)
@@ -334,51 +410,43 @@ class DiffProcessor:
             # Threshold the difference
             _, thresh = cv2.threshold(diff, 30, 255, cv2.THRESH_BINARY)
             
-            # Find contours
-            contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            # Create mask
-            mask = np.zeros_like(thresh)
-            
-            # Draw contours on the mask
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                if area > 100:  # Filter small changes
-                    cv2.drawContours(mask, [contour], 0, 255, -1)
-            
             # Dilate the mask to make changes more visible
             kernel = np.ones((5, 5), np.uint8)
-            mask_dilated = cv2.dilate(mask, kernel, iterations=2)
+            mask_dilated = cv2.dilate(thresh, kernel, iterations=2)
+            
+            # Label changed regions, getting their areas and bounding boxes in one pass
+            _, labels, stats, _ = cv2.connectedComponentsWithStats(mask_dilated, 8, cv2.CV_32S)
+            
+            # Filter small changes (label 0 is the background), areas shrink with the square of the scale
+            keep = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] > 100 * scale * scale) + 1
             
             # Create visual diff
             visual_diff = img2.copy()
             
             # Highlight changes in red
+            changed = np.isin(labels, keep).astype(np.uint8)
+            if scale < 1.0:
+                changed = cv2.resize(changed, (width, height), interpolation=cv2.INTER_NEAREST)
             red_mask = np.zeros_like(visual_diff)
-            red_mask[mask_dilated == 255] = [0, 0, 255]  # BGR format
+            red_mask[changed == 1] = [0, 0, 255]  # BGR format
             
             # Blend with original
             alpha = 0.7
             cv2.addWeighted(visual_diff, 1, red_mask, alpha, 0, visual_diff)
             
-            # Add rectangles around changes
-            contours, _ = cv2.findContours(mask_dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            for contour in contours:
-                x, y, w, h = cv2.boundingRect(contour)
-                cv2.rectangle(visual_diff, (x, y), (x + w, y + h), (0, 0, 255), 2)
+            # Add rectangles around changes, mapped back to full resolution
+            for x, y, w, h in stats[keep, :4] / scale:
+                cv2.rectangle(visual_diff, (int(x), int(y)), (int(x + w), int(y + h)), (0, 0, 255), 2)
             
             # Save the visual diff
             temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
             cv2.imwrite(temp_file.name, visual_diff)
             
-            # Store in the archive
+            # Store in the archive, moving the temp file into place
             visual_diff_path = self.storage.store_visual_diff(
-                archive_id, old_snapshot_id, new_snapshot_id, temp_file.name
+                archive_id, old_snapshot_id, new_snapshot_id, temp_file.name, is_temp=True
             )
             
-            # Clean up temp file
-            os.unlink(temp_file.name)
-            
             return visual_diff_path
         except ImportError:
             logger.warning("OpenCV not available, skipping visual diff generation")
@@ -0,0 +1,159 @@
+"""
+Myers O(ND) line diff.
+
+Produces the same (tag, i1, i2, j1, j2) opcodes as difflib's
+SequenceMatcher.get_opcodes(), so it can be used as a drop-in replacement.
+Runtime grows with the number of differences rather than with the square
+of the input size, which suits snapshots that change only slightly.
+"""
+import logging
+from difflib import SequenceMatcher
+
+logger = logging.getLogger('govwatcher-archive.processors.myers')
+
+# Above this many edits the stored search trace gets large, fall back to difflib
+MAX_EDIT_DISTANCE = 2000
+
+def myers_diff(a, b, max_edit_distance=MAX_EDIT_DISTANCE):
+    """Return SequenceMatcher-style opcodes turning sequence a into sequence b"""
+    n, m = len(a), len(b)
+    
+    # Identical input, nothing to search for
+    if a == b:
+        return [('equal', 0, n, 0, m)] if n else []
+    
+    # Strip the common prefix and suffix before searching
+    prefix = 0
+    limit = min(n, m)
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    
+    suffix = 0
+    while suffix < limit - prefix and a[n - 1 - suffix] == b[m - 1 - suffix]:
+        suffix += 1
+    
+    blocks = _shortest_edit(a, b, prefix, n - suffix, prefix, m - suffix, max_edit_distance)
+    if blocks is None:
+        logger.debug(f"Edit distance above {max_edit_distance}, falling back to SequenceMatcher")
+        return SequenceMatcher(None, a, b).get_opcodes()
+    
+    opcodes = []
+    if prefix:
+        opcodes.append(('equal', 0, prefix, 0, prefix))
+    opcodes.extend(_blocks_to_opcodes(blocks))
+    if suffix:
+        opcodes.append(('equal', n - suffix, n, m - suffix, m))
+    return opcodes
+
+def _shortest_edit(a, b, a_lo, a_hi, b_lo, b_hi, max_d):
+    """Find a shortest edit script between a[a_lo:a_hi] and b[b_lo:b_hi].
+    
+    Returns the script as a list of (tag, i1, i2, j1, j2) unit blocks in
+    order, or None if it needs more than max_d edits.
+    """
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    max_total = n + m
+    offset = max_total + 1
+    
+    # v[k + offset] is the furthest x reached on diagonal k = x - y
+    v = [0] * (2 * max_total + 3)
+    
+    # trace[d] holds v for diagonals -(d-1)..(d-1) as it was before round d
+    trace = []
+    
+    for d in range(max_total + 1):
+        if d > max_d:
+            return None
+        
+        trace.append(v[offset - d + 1:offset + d])
+        
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]  # Step down: insertion
+            else:
+                x = v[offset + k - 1] + 1  # Step right: deletion
+            y = x - k
+            
+            # Follow the diagonal of matching lines
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            
+            v[offset + k] = x
+            
+            if x >= n and y >= m:
+                return _backtrack(trace, d, n, m, a_lo, b_lo)
+    
+    return None
+
+def _backtrack(trace, d_end, n, m, a_lo, b_lo):
+    """Walk the search trace back from (n, m) to (0, 0) and collect the edit blocks"""
+    blocks = []
+    x, y = n, m
+    
+    for d in range(d_end, 0, -1):
+        v = trace[d]
+        k = x - y
+        
+        if k == -d or (k != d and v[k - 1 + d - 1] < v[k + 1 + d - 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        
+        prev_x = v[prev_k + d - 1]
+        prev_y = prev_x - prev_k
+        
+        # Diagonal run of equal lines after the edit
+        snake = x - prev_x if prev_k == k + 1 else y - prev_y
+        if snake > 0:
+            blocks.append(('equal', a_lo + x - snake, a_lo + x, b_lo + y - snake, b_lo + y))
+            x -= snake
+            y -= snake
+        
+        if prev_k == k + 1:
+            blocks.append(('insert', a_lo + x, a_lo + x, b_lo + y - 1, b_lo + y))
+        else:
+            blocks.append(('delete', a_lo + x - 1, a_lo + x, b_lo + y, b_lo + y))
+        
+        x, y = prev_x, prev_y
+    
+    # Whatever is left is the initial diagonal from (0, 0)
+    if x > 0:
+        blocks.append(('equal', a_lo, a_lo + x, b_lo, b_lo + y))
+    
+    blocks.reverse()
+    return blocks
+
+def _blocks_to_opcodes(blocks):
+    """Merge unit edit blocks into SequenceMatcher-style opcodes"""
+    opcodes = []
+    pending = None  # [i1, i2, j1, j2] of the current run of edits
+    
+    for tag, i1, i2, j1, j2 in blocks:
+        if tag == 'equal':
+            if pending:
+                opcodes.append(_edit_opcode(*pending))
+                pending = None
+            if opcodes and opcodes[-1][0] == 'equal':
+                opcodes[-1] = ('equal', opcodes[-1][1], i2, opcodes[-1][3], j2)
+            else:
+                opcodes.append(('equal', i1, i2, j1, j2))
+        elif pending:
+            pending[1] = i2
+            pending[3] = j2
+        else:
+            pending = [i1, i2, j1, j2]
+    
+    if pending:
+        opcodes.append(_edit_opcode(*pending))
+    
+    return opcodes
+
+def _edit_opcode(i1, i2, j1, j2):
+    """Tag a run of edits as a delete, insert or replace"""
+    if i1 == i2:
+        return ('insert', i1, i2, j1, j2)
+    if j1 == j2:
+        return ('delete', i1, i2, j1, j2)
+    return ('replace', i1, i2, j1, j2)
@@ -1,30 +1,54 @@
 import os
 import logging
-import shutil
-import hashlib
 from datetime import datetime
-import json
+from utils.fileops import fast_copy
+from utils.hashing import hash_file
+from utils.serialization import dumps, loads
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
 
 logger = logging.getLogger('govwatcher-archive.storage.manager')
 
+# diff.json format written by DiffProcessor, 2 stores each hunk's changes column-wise
+DIFF_FORMAT = 2
+
+# Change type for each character of a column-wise hunk's 'types' string
+CHANGE_TYPES = {' ': 'context', '+': 'insert', '-': 'delete'}
+
 class StorageManager:
     """Manages file storage for the archiving system"""
     
-    def __init__(self, config, db):
+    def __init__(self, config, db, zstd_threads=-1):
         self.config = config
         self.db = db
         self.base_path = config.STORAGE_PATH
         
+        # Diffs are stored zstd-compressed when zstandard is installed,
+        # zstd_threads=-1 uses every core and 0 compresses on the calling thread
+        self._zstd_compressor = zstd.ZstdCompressor(level=3, threads=zstd_threads) if zstd else None
+        
+        # Directories already created by this process, so repeat stores skip the mkdir syscalls
+        self._known_dirs = set()
+        
         # Ensure storage directories exist
         self._ensure_directories()
     
     def _ensure_directories(self):
         """Ensure all necessary directories exist"""
         # Base directory
-        os.makedirs(self.base_path, exist_ok=True)
+        self._ensure(self.base_path)
         
         # Subdirectories (will be created on demand)
     
+    def _ensure(self, path):
+        """Create a directory unless this process has already done so"""
+        if path not in self._known_dirs:
+            os.makedirs(path, exist_ok=True)
+            self._known_dirs.add(path)
+    
     def get_archive_path(self, archive_id):
         """Get the path for a specific archive"""
         return os.path.join(self.base_path, str(archive_id))
@@ -41,33 +65,33 @@ class StorageManager:
     def store_warc(self, archive_id, snapshot_id, warc_file):
         """Store a WARC file"""
         snapshot_dir = self.get_snapshot_path(archive_id, snapshot_id)
-        os.makedirs(snapshot_dir, exist_ok=True)
+        self._ensure(snapshot_dir)
         
-        target_path = os.path.join(snapshot_dir, 'original.warc')
+        target_path = os.path.join(snapshot_dir, 'original.warc.gz')
         
         # Copy the file (or move if it's a temporary file)
         if os.path.isfile(warc_file):
-            shutil.copy2(warc_file, target_path)
+            self._fast_copy(warc_file, target_path)
         
         return target_path
     
     def store_screenshot(self, archive_id, snapshot_id, screenshot_file):
         """Store a screenshot"""
         snapshot_dir = self.get_snapshot_path(archive_id, snapshot_id)
-        os.makedirs(snapshot_dir, exist_ok=True)
+        self._ensure(snapshot_dir)
         
         target_path = os.path.join(snapshot_dir, 'screenshot.png')
         
         # Copy the file
         if os.path.isfile(screenshot_file):
-            shutil.copy2(screenshot_file, target_path)
+            self._fast_copy(screenshot_file, target_path)
         
         return target_path
     
     def store_html(self, archive_id, snapshot_id, html_content):
         """Store HTML content"""
         snapshot_dir = self.get_snapshot_path(archive_id, snapshot_id)
-        os.makedirs(snapshot_dir, exist_ok=True)
+        self._ensure(snapshot_dir)
         
         target_path = os.path.join(snapshot_dir, 'content.html')
         
@@ -79,20 +103,15 @@ class StorageManager:
             with open(target_path, 'wb') as f:
                 f.write(html_content)
         
-        # Calculate hash
-        hasher = hashlib.sha256()
-        if isinstance(html_content, str):
-            hasher.update(html_content.encode('utf-8'))
-        else:
-            hasher.update(html_content)
-        content_hash = hasher.hexdigest()
+        # Hash the written file rather than re-encoding the content in memory
+        content_hash = hash_file(target_path, self.config.HASH_ALGO)
         
         return target_path, content_hash
     
     def store_text(self, archive_id, snapshot_id, text_content):
         """Store extracted text content"""
         snapshot_dir = self.get_snapshot_path(archive_id, snapshot_id)
-        os.makedirs(snapshot_dir, exist_ok=True)
+        self._ensure(snapshot_dir)
         
         target_path = os.path.join(snapshot_dir, 'content.txt')
         
@@ -106,42 +125,100 @@ class StorageManager:
     def store_pdf(self, archive_id, snapshot_id, pdf_file):
         """Store a PDF version"""
         snapshot_dir = self.get_snapshot_path(archive_id, snapshot_id)
-        os.makedirs(snapshot_dir, exist_ok=True)
+        self._ensure(snapshot_dir)
         
         target_path = os.path.join(snapshot_dir, 'content.pdf')
         
         # Copy the file
         if os.path.isfile(pdf_file):
-            shutil.copy2(pdf_file, target_path)
+            self._fast_copy(pdf_file, target_path)
         
         return target_path
     
     def store_diff(self, archive_id, old_snapshot_id, new_snapshot_id, diff_data):
         """Store diff data"""
         diff_dir = self.get_diff_path(archive_id, old_snapshot_id, new_snapshot_id)
-        os.makedirs(diff_dir, exist_ok=True)
+        self._ensure(diff_dir)
         
-        target_path = os.path.join(diff_dir, 'diff.json')
+        data = dumps(diff_data)
+        if self._zstd_compressor:
+            target_path = os.path.join(diff_dir, 'diff.json.zst')
+            data = self._zstd_compressor.compress(data)
+        else:
+            target_path = os.path.join(diff_dir, 'diff.json')
         
         # Write diff data to file
-        with open(target_path, 'w', encoding='utf-8') as f:
-            json.dump(diff_data, f)
+        with open(target_path, 'wb') as f:
+            f.write(data)
         
         return target_path
     
-    def store_visual_diff(self, archive_id, old_snapshot_id, new_snapshot_id, visual_diff_file):
+    def load_diff(self, diff_path):
+        """Load diff data stored by store_diff, with react-diff-view headers and change objects in every hunk"""
+        with open(diff_path, 'rb') as f:
+            data = f.read()
+        
+        if diff_path.endswith('.zst'):
+            if not zstd:
+                raise RuntimeError(f"zstandard is required to read {diff_path}")
+            data = zstd.ZstdDecompressor().decompress(data)
+        
+        diff_data = loads(data)
+        for hunk in diff_data.get('hunks', []):
+            # The header isn't stored, it follows from the hunk's line ranges
+            hunk.setdefault(
+                'content',
+                f"@@ -{hunk['oldStart']},{hunk['oldLines']} +{hunk['newStart']},{hunk['newLines']} @@"
+            )
+            
+            changes = hunk['changes']
+            if isinstance(changes, dict):
+                # Column-wise changes, zip them back into one object per line
+                hunk['changes'] = [
+                    {'type': CHANGE_TYPES[kind], 'content': content, 'oldLine': old_line, 'newLine': new_line}
+                    for kind, content, old_line, new_line in zip(
+                        changes['types'], changes['contents'], changes['oldLine'], changes['newLine']
+                    )
+                ]
+        return diff_data
+    
+    def store_visual_diff(self, archive_id, old_snapshot_id, new_snapshot_id, visual_diff_file, is_temp=False):
         """Store a visual diff image"""
         diff_dir = self.get_diff_path(archive_id, old_snapshot_id, new_snapshot_id)
-        os.makedirs(diff_dir, exist_ok=True)
+        self._ensure(diff_dir)
         
         target_path = os.path.join(diff_dir, 'visual-diff.png')
         
-        # Copy the file
+        # Copy the file (or move if it's a temporary file)
         if os.path.isfile(visual_diff_file):
-            shutil.copy2(visual_diff_file, target_path)
+            self._fast_copy(visual_diff_file, target_path, move=is_temp)
         
         return target_path
     
+    def _fast_copy(self, src, dst, move=False):
+        """Copy src to dst, avoiding a userspace copy of the data where the filesystem allows it"""
+        if move:
+            try:
+                os.replace(src, dst)
+                return
+            except OSError:
+                pass  # Different filesystem, copy below and remove the source
+        else:
+            # Hardlink when source and target share a filesystem
+            try:
+                if os.path.exists(dst):
+                    os.unlink(dst)
+                os.link(src, dst)
+                return
+            except OSError:
+                pass
+        
+        # Reflink, copy_file_range or copyfile, whichever the filesystem supports
+        fast_copy(src, dst)
+        
+        if move:
+            os.unlink(src)
+    
     def get_file_size(self, file_path):
         """Get the size of a file in bytes"""
         if os.path.isfile(file_path):
@@ -5,17 +5,27 @@ import os
 import subprocess
 import json
 import logging
-import shutil
-from urllib.parse import urlparse
+import re
+from concurrent.futures import ThreadPoolExecutor
+from utils.fileops import fast_copy
+from utils.html_text import html_to_text
+from utils.serialization import loads
 
 logger = logging.getLogger('govwatcher-archive.archivebox')
 
+# Snapshot directories named in 'archivebox add' output, e.g. archive/1700000000.123456
+SNAPSHOT_DIR_RE = re.compile(r'archive/(\d{10}\.\d+)')
+
+# Seconds a 'archivebox list' result is reused from the Redis cache
+LIST_CACHE_TTL = 5
+
 class ArchiveBoxClient:
     """Client for interacting with ArchiveBox"""
     
-    def __init__(self, config):
+    def __init__(self, config, redis_client=None):
         """Initialize the ArchiveBox client"""
         self.config = config
+        self.redis_client = redis_client
         self.binary = config.ARCHIVEBOX_BINARY
         self.data_dir = config.ARCHIVEBOX_DATA_DIR
         
@@ -57,15 +67,20 @@ class ArchiveBoxClient:
     
     def _parse_add_output(self, output, url):
         """Parse the output of the add command to get the snapshot directory"""
-        # Try to parse the ID of the created snapshot
-        domain = urlparse(url).netloc
+        # ArchiveBox prints the timestamp directories it writes, read the index from there
+        for timestamp in reversed(SNAPSHOT_DIR_RE.findall(output or '')):
+            snapshot = self._read_snapshot_index(timestamp)
+            if snapshot and snapshot.get('url') == url:
+                return snapshot
         
-        # ArchiveBox typically creates a subdirectory based on the URL
-        # We'll try to find it in the list of snapshots
+        # Otherwise find it in the list of snapshots, a cached listing may predate this add
         snapshots = self.list_snapshots()
+        matching_snapshots = [s for s in snapshots if s['url'] == url]
+        if not matching_snapshots:
+            snapshots = self.list_snapshots(use_cache=False)
+            matching_snapshots = [s for s in snapshots if s['url'] == url]
         
         # Find the most recent snapshot for this URL
-        matching_snapshots = [s for s in snapshots if s['url'] == url]
         if matching_snapshots:
             # Sort by timestamp, most recent first
             matching_snapshots.sort(key=lambda x: x['timestamp'], reverse=True)
@@ -73,8 +88,24 @@ class ArchiveBoxClient:
         
         return None
     
-    def list_snapshots(self, filter_domain=None, filter_tag=None, limit=100):
+    def _read_snapshot_index(self, timestamp):
+        """Load the index.json ArchiveBox writes into a snapshot directory"""
+        index_path = os.path.join(self.data_dir, 'archive', timestamp, 'index.json')
+        try:
+            with open(index_path, 'rb') as f:
+                return loads(f.read())
+        except (OSError, json.JSONDecodeError):
+            return None
+    
+    def list_snapshots(self, filter_domain=None, filter_tag=None, limit=100, use_cache=True):
         """List snapshots in ArchiveBox"""
+        # Listings are cached briefly, adds in quick succession share one subprocess call
+        cache_key = f"archivebox:list:{filter_domain}:{filter_tag}:{limit}"
+        if self.redis_client and use_cache:
+            cached = self.redis_client.cache_get(cache_key)
+            if isinstance(cached, list):
+                return cached
+        
         cmd = [self.binary, 'list', '--json']
         
         if filter_domain:
@@ -86,9 +117,11 @@ class ArchiveBoxClient:
         cmd.extend(['--limit', str(limit)])
         
         try:
-            result = subprocess.run(cmd, cwd=self.data_dir, check=True, 
-                                  capture_output=True, text=True)
-            snapshots = json.loads(result.stdout)
+            # orjson parses the raw stdout bytes, no text decode needed
+            result = subprocess.run(cmd, cwd=self.data_dir, check=True, capture_output=True)
+            snapshots = loads(result.stdout)
+            if self.redis_client:
+                self.redis_client.cache_set(cache_key, snapshots, ttl=LIST_CACHE_TTL)
             return snapshots
         except subprocess.CalledProcessError as e:
             logger.error(f"Failed to list ArchiveBox snapshots: {e}")
@@ -102,9 +135,8 @@ class ArchiveBoxClient:
         cmd = [self.binary, 'data', snapshot_id, '--json']
         
         try:
-            result = subprocess.run(cmd, cwd=self.data_dir, check=True, 
-                                  capture_output=True, text=True)
-            snapshot = json.loads(result.stdout)
+            result = subprocess.run(cmd, cwd=self.data_dir, check=True, capture_output=True)
+            snapshot = loads(result.stdout)
             return snapshot
         except subprocess.CalledProcessError as e:
             logger.error(f"Failed to get ArchiveBox snapshot {snapshot_id}: {e}")
@@ -125,37 +157,53 @@ class ArchiveBoxClient:
         
         # Copy the main files
         files_to_copy = {
-            'warc': ('archive.warc.gz', 'original.warc'),
+            'warc': ('archive.warc.gz', 'original.warc.gz'),
             'pdf': ('output.pdf', 'content.pdf'),
             'screenshot': ('screenshot.png', 'screenshot.png'),
             'html': ('index.html', 'content.html')
         }
         
-        copied_files = {}
-        
+        tasks = []
         for file_type, (src_name, dst_name) in files_to_copy.items():
             src_path = os.path.join(snapshot_dir, src_name)
             if os.path.exists(src_path):
-                dst_path = os.path.join(target_dir, dst_name)
-                shutil.copy2(src_path, dst_path)
-                copied_files[file_type] = dst_path
+                tasks.append((file_type, src_path, os.path.join(target_dir, dst_name)))
             else:
                 logger.debug(f"File not found in snapshot: {src_name}")
         
-        # Extract text content if available
-        if 'html' in copied_files:
-            try:
-                from bs4 import BeautifulSoup
-                with open(copied_files['html'], 'r', encoding='utf-8') as f:
-                    soup = BeautifulSoup(f.read(), 'html.parser')
-                    text = soup.get_text(separator='\n', strip=True)
-                    
-                    text_path = os.path.join(target_dir, 'content.txt')
-                    with open(text_path, 'w', encoding='utf-8') as f:
-                        f.write(text)
-                    
+        copied_files = {}
+        if not tasks:
+            return copied_files
+        
+        # The copies are independent and I/O-bound, so run them side by side
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            futures = {file_type: executor.submit(fast_copy, src_path, dst_path)
+                       for file_type, src_path, dst_path in tasks}
+            
+            # Extract text content as soon as the HTML is in place, while the larger files finish
+            if 'html' in futures:
+                copied_files['html'] = futures['html'].result()
+                text_path = self._extract_text(copied_files['html'], target_dir)
+                if text_path:
                     copied_files['text'] = text_path
-            except Exception as e:
-                logger.warning(f"Failed to extract text from HTML: {e}")
+            
+            for file_type, future in futures.items():
+                copied_files[file_type] = future.result()
         
         return copied_files
+    
+    def _extract_text(self, html_path, target_dir):
+        """Write the text content of an HTML file to content.txt, returns its path or None"""
+        try:
+            # Parse the raw bytes, lexbor detects the encoding itself
+            with open(html_path, 'rb') as f:
+                text = html_to_text(f.read())
+            
+            text_path = os.path.join(target_dir, 'content.txt')
+            with open(text_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            
+            return text_path
+        except Exception as e:
+            logger.warning(f"Failed to extract text from HTML: {e}")
+            return None
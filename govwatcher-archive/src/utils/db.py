@@ -1,17 +1,46 @@
 """
 Database connection and utility functions for the archive system.
 """
+import itertools
+import threading
+from contextlib import contextmanager
 import psycopg2
-import psycopg2.extras
+import psycopg2.extensions
+from psycopg2 import pool
 import logging
 
 logger = logging.getLogger('govwatcher-archive.db')
 
+# psycopg2.extras, imported on first use so processes that never query skip loading it
+_extras = None
+
+def _get_extras():
+    """Import psycopg2.extras once, on first use"""
+    global _extras
+    if _extras is None:
+        import psycopg2.extras
+        _extras = psycopg2.extras
+    return _extras
+
+class _ThreadState(threading.local):
+    """Per-thread database state, every thread sees its own copy of these attributes"""
+    
+    conn = None  # Connection checked out by this thread
+    depth = 0  # transaction() nesting depth on this thread, > 0 means transaction() owns the commit
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Pooled connection that autocommits outside transaction() and tracks its prepared statements"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.autocommit = True
+        self.prepared = set()
+
 class Database:
-    """PostgreSQL database connection manager"""
+    """PostgreSQL connection pool manager"""
     
-    def __init__(self, host, port, database, user, password):
-        """Initialize database connection"""
+    def __init__(self, host, port, database, user, password, minconn=1, maxconn=10, checkout_timeout=30):
+        """Initialize the database connection pool"""
         self.conn_params = {
             'host': host,
             'port': port,
@@ -19,100 +48,249 @@ class Database:
             'user': user,
             'password': password
         }
-        self.conn = None
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = None
+        
+        # ThreadedConnectionPool raises once all maxconn connections are out,
+        # so threads queue here for a free connection instead
+        self._available = threading.BoundedSemaphore(maxconn)
+        self.checkout_timeout = checkout_timeout
+        
+        self._cursor_factory = None  # DictCursor, resolved on the first execute()
+        
+        # SQL built by insert() and update(), keyed by everything that shapes the statement
+        self._insert_cache = {}
+        self._update_cache = {}
+        
+        # Suffix for server-side cursor names, unique within the process
+        self._cursor_ids = itertools.count()
+        
+        # Checked-out connection and transaction depth, never shared between threads
+        self._local = _ThreadState()
         self.connect()
     
     def connect(self):
-        """Establish database connection"""
+        """Create the connection pool"""
         try:
-            self.conn = psycopg2.connect(**self.conn_params)
-            logger.info("Database connection established")
+            self._pool = pool.ThreadedConnectionPool(
+                self.minconn, self.maxconn,
+                connection_factory=PooledConnection,
+                **self.conn_params
+            )
+            logger.info("Database connection pool established")
         except psycopg2.Error as e:
             logger.error(f"Failed to connect to database: {e}")
             raise
     
     def close(self):
-        """Close database connection"""
-        if self.conn:
-            self.conn.close()
-            logger.info("Database connection closed")
+        """Close all pooled connections"""
+        if self._pool and not self._pool.closed:
+            self._pool.closeall()
+            logger.info("Database connection pool closed")
+    
+    @contextmanager
+    def checkout(self):
+        """Check a connection out of the pool for the duration of the block.
+        
+        Nested checkouts and transaction() on the same thread share one connection.
+        When every connection is in use this waits up to checkout_timeout seconds.
+        """
+        conn = self._local.conn
+        if conn is not None:
+            yield conn
+            return
+        
+        if not self._available.acquire(timeout=self.checkout_timeout):
+            raise pool.PoolError(f"No database connection free after {self.checkout_timeout} seconds")
+        
+        try:
+            conn = self._pool.getconn()
+        except BaseException:
+            self._available.release()
+            raise
+        
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            # Broken connections are discarded rather than handed out again
+            self._pool.putconn(conn, close=bool(conn.closed))
+            self._available.release()
     
-    def get_connection(self):
-        """Get the current database connection"""
-        if not self.conn or self.conn.closed:
-            self.connect()
-        return self.conn
+    def _in_transaction(self):
+        """Whether the current thread is inside transaction(), which owns the commit"""
+        return self._local.depth > 0
     
-    def execute(self, query, params=None, commit=False):
-        """Execute a query and return the cursor"""
-        conn = self.get_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    @contextmanager
+    def _handle_errors(self, conn, query, label, detail):
+        """Roll back and log a failed statement, unless transaction() owns the connection"""
         try:
-            cursor.execute(query, params)
-            if commit:
-                conn.commit()
-            return cursor
+            yield
         except psycopg2.Error as e:
-            conn.rollback()
+            # Inside transaction() the caller decides, e.g. rolling back to a savepoint
+            if not conn.closed and not self._in_transaction():
+                conn.rollback()
             logger.error(f"Database error: {e}")
-            logger.debug(f"Query: {query}, Params: {params}")
+            logger.debug(f"Query: {query}, {label}: {detail}")
             raise
     
-    def query_one(self, query, params=None):
+    def _execute(self, query, params, commit, fetch):
+        """Execute a query and read its result before the connection goes back to the pool.
+        
+        fetch is 'one' or 'all' for rows, anything else returns the rowcount.
+        """
+        with self.checkout() as conn:
+            if self._cursor_factory is None:
+                self._cursor_factory = _get_extras().DictCursor
+            with self._handle_errors(conn, query, 'Params', params):
+                with conn.cursor(cursor_factory=self._cursor_factory) as cursor:
+                    cursor.execute(query, params)
+                    if fetch == 'one':
+                        result = cursor.fetchone()
+                    elif fetch == 'all':
+                        result = cursor.fetchall()
+                    else:
+                        result = cursor.rowcount
+                if commit and not self._in_transaction():
+                    conn.commit()
+                return result
+    
+    def execute(self, query, params=None, commit=False):
+        """Execute a query and return the number of rows it affected"""
+        return self._execute(query, params, commit, None)
+    
+    def query_one(self, query, params=None, commit=False):
         """Execute a query and return a single result"""
-        cursor = self.execute(query, params)
-        return cursor.fetchone()
+        return self._execute(query, params, commit, 'one')
     
-    def query_all(self, query, params=None):
+    def query_all(self, query, params=None, commit=False):
         """Execute a query and return all results"""
-        cursor = self.execute(query, params)
-        return cursor.fetchall()
-    
-    def insert(self, table, data, returning='id'):
-        """Insert data into a table and return the specified column"""
-        columns = data.keys()
-        values = [data[column] for column in columns]
-        placeholders = [f"%({col})s" for col in columns]
-        
-        query = f"""
-            INSERT INTO {table} ({', '.join(columns)})
-            VALUES ({', '.join(placeholders)})
+        return self._execute(query, params, commit, 'all')
+    
+    def query_iter(self, query, params=None, batch=1000):
+        """Yield the rows of a query from a server-side cursor, batch rows per round-trip.
+        
+        Memory stays bounded by batch however large the result is. Named cursors
+        only live inside a transaction, which is held until the generator finishes.
         """
+        with self.transaction() as txn:
+            cursor = txn.conn.cursor(
+                name=f"query_iter_{next(self._cursor_ids)}",
+                cursor_factory=_get_extras().RealDictCursor
+            )
+            cursor.itersize = batch
+            try:
+                cursor.execute(query, params)
+                yield from cursor
+            finally:
+                if not txn.conn.closed:
+                    cursor.close()
+    
+    def query_one_prepared(self, name, sql, params):
+        """Execute a server-side prepared statement and return a single result.
         
-        if returning:
-            query += f" RETURNING {returning}"
+        sql uses $1, $2, ... placeholders and is prepared once per connection under name.
+        """
+        with self.checkout() as conn:
+            if name not in conn.prepared:
+                self.execute(f"PREPARE {name} AS {sql}")
+                conn.prepared.add(name)
+            
+            placeholders = ', '.join(['%s'] * len(params))
+            return self.query_one(f"EXECUTE {name} ({placeholders})", params)
+    
+    def insert(self, table, data, returning='id', on_conflict=None):
+        """Insert data into a table and return the specified column.
+        
+        on_conflict is appended as an ON CONFLICT clause, e.g. '(col) DO NOTHING',
+        in which case None is returned when the row already exists.
+        """
+        columns = tuple(data.keys())
+        key = (table, columns, returning, on_conflict)
+        query = self._insert_cache.get(key)
+        if query is None:
+            placeholders = [f"%({col})s" for col in columns]
+            
+            query = f"""
+                INSERT INTO {table} ({', '.join(columns)})
+                VALUES ({', '.join(placeholders)})
+            """
+            
+            if on_conflict:
+                query += f" ON CONFLICT {on_conflict}"
+            
+            if returning:
+                query += f" RETURNING {returning}"
+            
+            self._insert_cache[key] = query
         
-        cursor = self.execute(query, data, commit=True)
         if returning:
-            result = cursor.fetchone()
+            result = self.query_one(query, data, commit=True)
             return result[0] if result else None
+        self.execute(query, data, commit=True)
         return None
     
+    def insert_many(self, table, rows, commit=True, on_conflict=None):
+        """Insert multiple rows (dicts with the same keys) into a table in one batch.
+        
+        on_conflict is appended as an ON CONFLICT clause, as in insert().
+        """
+        if not rows:
+            return 0
+        
+        columns = list(rows[0].keys())
+        template = f"({', '.join(f'%({col})s' for col in columns)})"
+        
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s"
+        if on_conflict:
+            query += f" ON CONFLICT {on_conflict}"
+        
+        self.execute_values(query, rows, template=template, commit=commit)
+        return len(rows)
+    
+    def execute_values(self, query, rows, template=None, commit=True):
+        """Execute a query with a VALUES %s placeholder expanded to many rows in one call"""
+        if not rows:
+            return 0
+        
+        with self.checkout() as conn:
+            with self._handle_errors(conn, query, 'Rows', len(rows)):
+                with conn.cursor() as cursor:
+                    # Sends a single multi-row statement per page of rows
+                    _get_extras().execute_values(cursor, query, rows, template=template, page_size=1000)
+                    rowcount = cursor.rowcount
+                if commit and not self._in_transaction():
+                    conn.commit()
+                return rowcount
+    
     def update(self, table, data, condition, condition_params=None):
         """Update data in a table based on a condition"""
         if not data:
             return 0
         
-        set_clauses = [f"{column} = %({column})s" for column in data.keys()]
-        params = data.copy()
+        key = (table, tuple(data.keys()), condition)
+        query = self._update_cache.get(key)
+        if query is None:
+            set_clauses = [f"{column} = %({column})s" for column in data.keys()]
+            query = f"""
+                UPDATE {table}
+                SET {', '.join(set_clauses)}
+                WHERE {condition}
+            """
+            self._update_cache[key] = query
         
+        params = data.copy()
         if condition_params:
             params.update(condition_params)
         
-        query = f"""
-            UPDATE {table}
-            SET {', '.join(set_clauses)}
-            WHERE {condition}
-        """
-        
-        cursor = self.execute(query, params, commit=True)
-        return cursor.rowcount
+        return self.execute(query, params, commit=True)
     
     def delete(self, table, condition, params=None):
         """Delete rows from a table based on a condition"""
         query = f"DELETE FROM {table} WHERE {condition}"
-        cursor = self.execute(query, params, commit=True)
-        return cursor.rowcount
+        return self.execute(query, params, commit=True)
     
     def transaction(self):
         """Context manager for database transactions"""
@@ -124,18 +302,41 @@ class Transaction:
     def __init__(self, db):
         self.db = db
         self.conn = None
+        self._checkout = None
     
     def __enter__(self):
-        self.conn = self.db.get_connection()
+        local = self.db._local
+        depth = local.depth
+        if not depth:
+            # Hold one pooled connection for the whole transaction
+            self._checkout = self.db.checkout()
+            conn = self._checkout.__enter__()
+            conn.autocommit = False
+        local.depth = depth + 1
+        self.conn = local.conn
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is None:
-            # No exception occurred, commit the transaction
-            self.conn.commit()
-        else:
-            # Exception occurred, rollback the transaction
-            self.conn.rollback()
-            logger.error(f"Transaction rolled back due to: {exc_val}")
-        
-        return False  # Don't suppress exceptions 
\ No newline at end of file
+        local = self.db._local
+        local.depth -= 1
+        if local.depth:
+            # Nested block, the outermost transaction commits or rolls back
+            return False
+        
+        try:
+            if exc_type is None:
+                # No exception occurred, commit the transaction
+                self.conn.commit()
+            else:
+                # Exception occurred, rollback the transaction
+                self.conn.rollback()
+                logger.error(f"Transaction rolled back due to: {exc_val}")
+        finally:
+            if not self.conn.closed:
+                # Back to autocommit before the connection returns to the pool
+                self.conn.rollback()
+                self.conn.autocommit = True
+            self._checkout.__exit__(None, None, None)
+            self._checkout = None
+        
+        return False  # Don't suppress exceptions
@@ -0,0 +1,49 @@
+"""
+Content hashing for change detection.
+Hashes carry an algorithm prefix (e.g. "b3:...", "sha256:...") so values
+produced by different algorithms never compare equal by accident.
+"""
+import hashlib
+import logging
+
+logger = logging.getLogger('govwatcher-archive.hashing')
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+def configured_algo():
+    """Return the hash algorithm selected by config.HASH_ALGO"""
+    from config import get_config
+    return get_config().HASH_ALGO
+
+class ContentHasher:
+    """Incremental content hash, BLAKE3 when available and SHA-256 otherwise"""
+    
+    def __init__(self, algo=None):
+        # Default to the configured algorithm so every caller produces comparable hashes
+        if algo is None:
+            algo = configured_algo()
+        if algo == 'blake3' and blake3 is not None:
+            self.prefix = 'b3'
+            self._hasher = blake3.blake3()
+        else:
+            self.prefix = 'sha256'
+            self._hasher = hashlib.sha256()
+    
+    def update(self, data):
+        """Feed more bytes into the hash"""
+        self._hasher.update(data)
+    
+    def hexdigest(self):
+        """Return the prefixed hex digest"""
+        return f"{self.prefix}:{self._hasher.hexdigest()}"
+
+def hash_file(path, algo=None, chunk=1 << 20):
+    """Hash a file in fixed-size chunks and return the prefixed hex digest"""
+    hasher = ContentHasher(algo)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
@@ -0,0 +1,21 @@
+"""
+Visible-text extraction from HTML, shared by the crawler and the ArchiveBox client.
+"""
+import logging
+from selectolax.lexbor import LexborHTMLParser
+
+logger = logging.getLogger('govwatcher-archive.html_text')
+
+def html_to_text(raw, encoding=None):
+    """Extract the visible text from raw HTML bytes"""
+    try:
+        tree = LexborHTMLParser(raw)
+        node = tree.body or tree.root
+        if node is not None:
+            return node.text(separator='\n', strip=True)
+    except Exception as e:
+        logger.debug(f"lexbor failed to parse page, falling back to BeautifulSoup: {e}")
+    
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(raw.decode(encoding or 'utf-8', errors='replace'), 'html.parser')
+    return soup.get_text(separator='\n', strip=True)
@@ -1,11 +1,128 @@
 import csv
+import io
 import logging
 from datetime import datetime
-from models.archive import Archive
 import os
+from operator import itemgetter
+import psycopg2
 
 logger = logging.getLogger('govwatcher-archive.utils.importers')
 
+# Rows sent per multi-row upsert
+BATCH_SIZE = 1000
+
+# Rows between savepoints, a failing batch only rolls back its own chunk
+SAVEPOINT_ROWS = 10000
+
+# Domains looked up per existence query
+PREFETCH_SIZE = 10000
+
+# Archive columns filled from the CSV, everything else keeps its default or current value
+IMPORT_COLUMNS = ('domain', 'domain_type', 'agency', 'organization_name', 'city', 'state',
+                  'security_contact_email', 'priority', 'enabled')
+
+# CSV columns read per row, with the value used when the file has no such column
+CSV_FIELDS = (('domain', ''), ('domainType', None), ('agency', None), ('federalAgency', None),
+              ('organizationName', ''), ('city', ''), ('state', ''), ('securityContact', ''))
+
+UPSERT_QUERY = f"""
+    INSERT INTO archives ({', '.join(IMPORT_COLUMNS)})
+    VALUES %s
+    ON CONFLICT (domain) DO UPDATE SET
+        {', '.join(f'{col} = EXCLUDED.{col}' for col in IMPORT_COLUMNS if col != 'domain')}
+"""
+
+COPY_QUERY = f"COPY archives ({', '.join(IMPORT_COLUMNS)}) FROM STDIN"
+
+# Characters that must be backslash-escaped in COPY's text format
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+def _copy_field(value):
+    """Format a value as a COPY text-format field"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).translate(COPY_ESCAPES)
+
+def _copy_buffer(rows):
+    """Render rows as a COPY text-format buffer"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_field(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+def _fetch_existing(db, domains):
+    """Map the given domains that are already archived to their ids"""
+    existing = {}
+    for start in range(0, len(domains), PREFETCH_SIZE):
+        # Each lookup is streamed back in pages rather than materialized at once
+        rows = db.query_iter(
+            "SELECT id, domain FROM archives WHERE domain = ANY(%s)",
+            (domains[start:start + PREFETCH_SIZE],),
+            batch=BATCH_SIZE
+        )
+        existing.update((row['domain'], row['id']) for row in rows)
+    return existing
+
+def _read_rows(csv_file, priority_domains):
+    """Read the domains CSV into archive column values.
+    
+    Returns the number of data rows read and a dict of domain -> IMPORT_COLUMNS
+    values, where a repeated domain keeps its last row.
+    """
+    total = 0
+    rows = {}
+    
+    with open(csv_file, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        headers = next(reader, [])
+        width = len(headers)
+        index = {name: i for i, name in enumerate(headers)}
+        
+        # Absent columns point past the end of the row, at padding holding their default
+        padding = [None, '']
+        get_fields = itemgetter(*(
+            index.get(name, width + padding.index(default)) for name, default in CSV_FIELDS
+        ))
+        
+        for row in reader:
+            if not row:
+                continue  # Blank line
+            
+            total += 1
+            # Fit the row to the header so the padding always lands at index width
+            if len(row) != width:
+                row = row[:width] + [None] * (width - len(row))
+            row += padding
+            
+            # Map CSV columns to Archive fields
+            (domain, domain_type, agency, federal_agency, organization_name,
+             city, state, security_contact) = get_fields(row)
+            
+            if not domain:
+                continue
+            domain = domain.lower()
+            
+            # Set priority based on whether it's in priority_domains
+            priority = 1 if domain in priority_domains else 3
+            
+            rows[domain] = (
+                domain,
+                domain_type,
+                agency or federal_agency,
+                organization_name,
+                city,
+                state,
+                security_contact,
+                priority,
+                True
+            )
+    
+    return total, rows
+
 def import_domains(db, csv_file, priority_csv=None):
     """
     Import domains from a CSV file into the database.
@@ -31,52 +148,57 @@ def import_domains(db, csv_file, priority_csv=None):
         logger.info(f"Loaded {len(priority_domains)} priority domains")
     
     # Import domains from main CSV
+    total, rows = _read_rows(csv_file, priority_domains)
+    
+    values = list(rows.values())
     created = 0
     updated = 0
-    total = 0
+    failed = 0
     
-    with open(csv_file, 'r', newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            total += 1
-            # Map CSV columns to Archive fields
-            domain = row.get('domain', '').lower()
-            
-            if not domain:
-                continue
-            
-            # Check if domain already exists
-            existing = Archive.get_by_domain(db, domain)
+    # One transaction for the whole import, so it costs a single commit
+    with db.transaction() as txn:
+        cursor = txn.conn.cursor()
+        
+        # Nothing is lost on a crash that a re-run of the import wouldn't restore
+        cursor.execute("SET LOCAL synchronous_commit = off")
+        
+        # Imports run one at a time, so two of them can't both find the table empty and COPY into it
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('import_domains'))")
+        
+        # An empty table means a first seed, every row is new and can be COPYed in
+        seeding = db.query_one("SELECT 1 FROM archives LIMIT 1") is None
+        
+        if seeding:
+            # Rows are already unique by domain, so the whole seed goes in one COPY
+            cursor.copy_expert(COPY_QUERY, _copy_buffer(values))
+            created = len(values)
+            logger.info(f"Copied {len(values)} domains...")
+        else:
+            # Look up which domains already exist in a few bulk queries instead of one per row
+            existing = _fetch_existing(db, list(rows))
             
-            # Set priority based on whether it's in priority_domains
-            priority = 1 if domain in priority_domains else 3
-            
-            archive_data = {
-                'domain': domain,
-                'domain_type': row.get('domainType'),
-                'agency': row.get('agency') or row.get('federalAgency'),
-                'organization_name': row.get('organizationName', ''),
-                'city': row.get('city', ''),
-                'state': row.get('state', ''),
-                'security_contact_email': row.get('securityContact', ''),
-                'priority': priority,
-                'enabled': True
-            }
-            
-            if existing:
-                # Update existing domain
-                archive = Archive.from_dict({**archive_data, 'id': existing.id})
-                archive.save(db)
-                updated += 1
-            else:
-                # Create new domain
-                archive = Archive.from_dict(archive_data)
-                archive.save(db)
-                created += 1
-            
-            # Commit every 100 records
-            if (created + updated) % 100 == 0:
-                logger.info(f"Processed {created + updated} domains...")
+            for chunk_start in range(0, len(values), SAVEPOINT_ROWS):
+                chunk = values[chunk_start:chunk_start + SAVEPOINT_ROWS]
+                cursor.execute("SAVEPOINT import_cp")
+                try:
+                    for start in range(0, len(chunk), BATCH_SIZE):
+                        db.execute_values(UPSERT_QUERY, chunk[start:start + BATCH_SIZE])
+                    cursor.execute("RELEASE SAVEPOINT import_cp")
+                except psycopg2.Error as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT import_cp")
+                    failed += len(chunk)
+                    logger.error(f"Skipped domains {chunk_start + 1}-{chunk_start + len(chunk)}: {e}")
+                    continue
+                
+                # Only chunks that made it in count towards the totals
+                chunk_updated = sum(1 for value in chunk if value[0] in existing)
+                updated += chunk_updated
+                created += len(chunk) - chunk_updated
+                
+                logger.info(f"Processed {chunk_start + len(chunk)} domains...")
+    
+    if failed:
+        logger.warning(f"{failed} domains were not imported")
     
-    logger.info(f"Import complete: {total} total, {created} created, {updated} updated")
+    logger.info(f"Import complete: {total} total, {created} created, {updated} updated, {failed} failed")
     return total, created, updated
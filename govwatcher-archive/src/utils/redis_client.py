@@ -5,10 +5,59 @@ Handles queue management, caching, and pub/sub.
 import json
 import time
 import logging
+from itertools import islice
 import redis
+from utils.serialization import dumps, loads
 
 logger = logging.getLogger('govwatcher-archive.redis')
 
+# Pop the highest priority job, fetch it and mark it as processing atomically
+DEQUEUE_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then
+    return false
+end
+local job_id = popped[1]
+local job_key = 'jobs:' .. job_id
+local job = redis.call('HGETALL', job_key)
+if #job > 0 then
+    redis.call('HSET', job_key, 'status', 'processing', 'started_at', ARGV[1])
+    redis.call('SADD', KEYS[2], job_id)
+end
+return {job_id, job}
+"""
+
+# Take a lock with SET NX PX, or report how many ms the current holder has left
+ACQUIRE_LOCK_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return {1, 0}
+end
+return {0, redis.call('PTTL', KEYS[1])}
+"""
+
+# Seconds between attempts when less than a second is left to wait, BLPOP only blocks in whole seconds
+LOCK_POLL_INTERVAL = 0.05
+
+# Release a lock only if we own it, and wake one waiter blocked in acquire_lock
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    redis.call('LPUSH', KEYS[2], '1')
+    redis.call('EXPIRE', KEYS[2], 1)
+    return 1
+end
+return 0
+"""
+
+def _chunks(iterable, size):
+    """Yield lists of up to size items from an iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 class RedisClient:
     """Redis client wrapper with utility functions"""
     
@@ -22,6 +71,9 @@ class RedisClient:
             'decode_responses': True,  # Return strings instead of bytes
         }
         self.redis = None
+        self._dequeue_script = None
+        self._acquire_lock_script = None
+        self._release_lock_script = None
         self.connect()
     
     def connect(self):
@@ -29,6 +81,9 @@ class RedisClient:
         try:
             self.redis = redis.Redis(**self.conn_params)
             self.redis.ping()  # Test connection
+            self._dequeue_script = self.redis.register_script(DEQUEUE_SCRIPT)
+            self._acquire_lock_script = self.redis.register_script(ACQUIRE_LOCK_SCRIPT)
+            self._release_lock_script = self.redis.register_script(RELEASE_LOCK_SCRIPT)
             logger.info("Redis connection established")
         except redis.RedisError as e:
             logger.error(f"Failed to connect to Redis: {e}")
@@ -50,48 +105,67 @@ class RedisClient:
         """Add a job to a priority queue"""
         job_id = f"job:{int(time.time())}:{job_data.get('id', '')}"
         
-        # Store job data
+        # Store job data and add it to the priority queue in one round-trip
         job_key = f"jobs:{job_id}"
-        self.redis.hset(job_key, mapping={
-            'status': 'pending',
-            'priority': priority,
-            'created_at': int(time.time()),
-            'data': json.dumps(job_data)
-        })
-        
-        # Add to priority queue
-        self.redis.zadd(f"queue:{queue_name}", {job_id: priority})
+        with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(job_key, mapping={
+                'status': 'pending',
+                'priority': priority,
+                'created_at': int(time.time()),
+                'data': dumps(job_data)
+            })
+            pipe.zadd(f"queue:{queue_name}", {job_id: priority})
+            pipe.execute()
         
         logger.debug(f"Job {job_id} added to queue {queue_name} with priority {priority}")
         return job_id
     
+    def enqueue_jobs_batch(self, queue_name, jobs):
+        """Add multiple (job_data, priority) jobs to a priority queue in one round-trip"""
+        now = int(time.time())
+        job_ids = []
+        
+        pipe = self.redis.pipeline(transaction=False)
+        for job_data, priority in jobs:
+            job_id = f"job:{now}:{job_data.get('id', '')}"
+            
+            # Store job data
+            pipe.hset(f"jobs:{job_id}", mapping={
+                'status': 'pending',
+                'priority': priority,
+                'created_at': now,
+                'data': dumps(job_data)
+            })
+            
+            # Add to priority queue
+            pipe.zadd(f"queue:{queue_name}", {job_id: priority})
+            job_ids.append(job_id)
+        
+        pipe.execute()
+        
+        logger.debug(f"{len(job_ids)} jobs added to queue {queue_name}")
+        return job_ids
+    
     def get_next_job(self, queue_name):
         """Get the next job from a priority queue"""
-        # Get job with highest priority (lowest score)
-        result = self.redis.zpopmin(f"queue:{queue_name}", count=1)
+        # Pop the job with highest priority (lowest score), fetch it and mark it as processing
+        result = self._dequeue_script(
+            keys=[f"queue:{queue_name}", f"processing:{queue_name}"],
+            args=[int(time.time())]
+        )
         if not result:
             return None
         
-        job_id, _ = result[0]  # Unpack the (job_id, score) tuple
-        
-        # Get job data
-        job_key = f"jobs:{job_id}"
-        job_data = self.redis.hgetall(job_key)
+        job_id, fields = result
+        job_data = dict(zip(fields[::2], fields[1::2]))
         
         if not job_data:
             logger.warning(f"Job {job_id} not found in Redis")
             return None
         
-        # Update job status
-        self.redis.hset(job_key, 'status', 'processing')
-        self.redis.hset(job_key, 'started_at', int(time.time()))
-        
-        # Add to processing set
-        self.redis.sadd(f"processing:{queue_name}", job_id)
-        
         try:
             # Parse job data
-            data = json.loads(job_data.get('data', '{}'))
+            data = loads(job_data.get('data', '{}'))
             return {
                 'id': job_id,
                 'priority': int(job_data.get('priority', 5)),
@@ -102,60 +176,104 @@ class RedisClient:
             logger.error(f"Failed to parse job data: {e}")
             return None
     
+    def dequeue_batch(self, queue_name, count):
+        """Get up to count jobs from a priority queue in one round-trip"""
+        if count <= 0:
+            return []
+        
+        # Get jobs with highest priority (lowest score)
+        job_ids = [job_id for job_id, _ in self.redis.zpopmin(f"queue:{queue_name}", count=count)]
+        if not job_ids:
+            return []
+        
+        # Fetch job data and mark the jobs as processing
+        now = int(time.time())
+        pipe = self.redis.pipeline(transaction=False)
+        for job_id in job_ids:
+            job_key = f"jobs:{job_id}"
+            pipe.hgetall(job_key)
+            pipe.hset(job_key, mapping={'status': 'processing', 'started_at': now})
+            pipe.sadd(f"processing:{queue_name}", job_id)
+        results = pipe.execute()
+        
+        jobs = []
+        for job_id, job_data in zip(job_ids, results[::3]):
+            if not job_data:
+                logger.warning(f"Job {job_id} not found in Redis")
+                continue
+            
+            try:
+                jobs.append({
+                    'id': job_id,
+                    'priority': int(job_data.get('priority', 5)),
+                    'created_at': int(job_data.get('created_at', 0)),
+                    'data': loads(job_data.get('data', '{}'))
+                })
+            except json.JSONDecodeError as e:
+                logger.error(f"Failed to parse job data: {e}")
+        
+        return jobs
+    
     def complete_job(self, queue_name, job_id, result=None):
         """Mark a job as completed"""
         job_key = f"jobs:{job_id}"
         
         # Update job status
-        self.redis.hset(job_key, 'status', 'completed')
-        self.redis.hset(job_key, 'completed_at', int(time.time()))
-        
+        status = {'status': 'completed', 'completed_at': int(time.time())}
         if result:
-            self.redis.hset(job_key, 'result', json.dumps(result))
+            status['result'] = dumps(result)
         
-        # Remove from processing set
-        self.redis.srem(f"processing:{queue_name}", job_id)
-        
-        # Increment completed counter
-        self.redis.incr(f"stats:{queue_name}:completed")
+        with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(job_key, mapping=status)
+            
+            # Remove from processing set
+            pipe.srem(f"processing:{queue_name}", job_id)
+            
+            # Increment completed counter
+            pipe.incr(f"stats:{queue_name}:completed")
+            pipe.execute()
         
         logger.debug(f"Job {job_id} marked as completed")
     
     def fail_job(self, queue_name, job_id, error=None, retry=False, max_retries=3):
-        """Mark a job as failed and optionally requeue"""
+        """Mark a job as failed and optionally requeue, return True if it was requeued"""
         job_key = f"jobs:{job_id}"
         
-        # Get current retry count
-        retries = int(self.redis.hget(job_key, 'retries') or 0)
+        # Get current retry count and priority
+        retries, priority = self.redis.hmget(job_key, 'retries', 'priority')
+        retries = int(retries or 0)
+        requeue = retry and retries < max_retries
         
-        if retry and retries < max_retries:
-            # Increment retry count
-            self.redis.hincrby(job_key, 'retries', 1)
-            self.redis.hset(job_key, 'last_error', str(error) if error else 'Unknown error')
-            
-            # Get job priority
-            priority = int(self.redis.hget(job_key, 'priority') or 5)
-            
-            # Add back to queue with adjusted priority
-            self.redis.zadd(f"queue:{queue_name}", {job_id: priority + 1})
-            self.redis.hset(job_key, 'status', 'pending')
-            
-            logger.info(f"Job {job_id} requeued for retry {retries + 1}/{max_retries}")
-        else:
-            # Mark as failed
-            self.redis.hset(job_key, 'status', 'failed')
-            self.redis.hset(job_key, 'failed_at', int(time.time()))
-            
-            if error:
-                self.redis.hset(job_key, 'error', str(error))
+        with self.redis.pipeline(transaction=True) as pipe:
+            if requeue:
+                # Add back to queue with adjusted priority
+                pipe.zadd(f"queue:{queue_name}", {job_id: int(priority or 5) + 1})
+                
+                # Bump the retry count in the same HSET as the status
+                pipe.hset(job_key, mapping={
+                    'status': 'pending',
+                    'retries': retries + 1,
+                    'last_error': str(error) if error else 'Unknown error'
+                })
+                
+                logger.info(f"Job {job_id} requeued for retry {retries + 1}/{max_retries}")
+            else:
+                # Mark as failed
+                status = {'status': 'failed', 'failed_at': int(time.time())}
+                if error:
+                    status['error'] = str(error)
+                pipe.hset(job_key, mapping=status)
+                
+                # Increment failed counter
+                pipe.incr(f"stats:{queue_name}:failed")
+                
+                logger.warning(f"Job {job_id} marked as failed: {error}")
             
-            # Increment failed counter
-            self.redis.incr(f"stats:{queue_name}:failed")
-            
-            logger.warning(f"Job {job_id} marked as failed: {error}")
+            # Remove from processing set
+            pipe.srem(f"processing:{queue_name}", job_id)
+            pipe.execute()
         
-        # Remove from processing set
-        self.redis.srem(f"processing:{queue_name}", job_id)
+        return requeue
     
     def get_queue_stats(self, queue_name):
         """Get statistics for a queue"""
@@ -177,7 +295,7 @@ class RedisClient:
     def cache_set(self, key, value, ttl=300):
         """Set a cached value with TTL"""
         if isinstance(value, (dict, list)):
-            value = json.dumps(value)
+            value = dumps(value)
         
         self.redis.set(f"cache:{key}", value, ex=ttl)
     
@@ -189,7 +307,7 @@ class RedisClient:
             return default
         
         try:
-            return json.loads(value)
+            return loads(value)
         except json.JSONDecodeError:
             return value
     
@@ -199,17 +317,22 @@ class RedisClient:
     
     def cache_invalidate_pattern(self, pattern):
         """Invalidate all cache keys matching a pattern"""
-        keys = self.redis.keys(f"cache:{pattern}")
-        if keys:
-            self.redis.delete(*keys)
-            logger.debug(f"Invalidated {len(keys)} cache keys matching pattern '{pattern}'")
+        # SCAN pages through the keyspace without blocking the server like KEYS does,
+        # and UNLINK frees the values in a background thread
+        invalidated = 0
+        for keys in _chunks(self.redis.scan_iter(match=f"cache:{pattern}", count=1000), 500):
+            self.redis.unlink(*keys)
+            invalidated += len(keys)
+        
+        if invalidated:
+            logger.debug(f"Invalidated {invalidated} cache keys matching pattern '{pattern}'")
     
     # Pub/Sub
     
     def publish(self, channel, message):
         """Publish a message to a channel"""
         if isinstance(message, (dict, list)):
-            message = json.dumps(message)
+            message = dumps(message)
         
         self.redis.publish(channel, message)
         logger.debug(f"Published message to channel '{channel}'")
@@ -229,13 +352,24 @@ class RedisClient:
         
         deadline = time.time() + timeout
         while time.time() < deadline:
-            # Try to acquire the lock
-            if self.redis.set(lock_key, identifier, ex=expire, nx=True):
+            # Try to acquire the lock, learning the holder's remaining TTL in the same round trip
+            acquired, pttl = self._acquire_lock_script(
+                keys=[lock_key], args=[identifier, int(expire * 1000)]
+            )
+            if acquired:
                 logger.debug(f"Acquired lock '{name}'")
                 return identifier
             
-            # Wait before retrying
-            time.sleep(0.1)
+            # Wait for release_lock to hand off, but no longer than the lock could live
+            remaining = deadline - time.time()
+            if pttl > 0:
+                remaining = min(remaining, pttl / 1000)
+            
+            if remaining >= 1:
+                # Round down so the wait never runs past the deadline
+                self.redis.blpop(f"lockwait:{name}", timeout=int(remaining))
+            elif remaining > 0:
+                time.sleep(min(remaining, LOCK_POLL_INTERVAL))
         
         logger.warning(f"Failed to acquire lock '{name}' after {timeout} seconds")
         return None
@@ -245,15 +379,7 @@ class RedisClient:
         lock_key = f"lock:{name}"
         
         # Only release if we own the lock
-        script = """
-        if redis.call("get", KEYS[1]) == ARGV[1] then
-            return redis.call("del", KEYS[1])
-        else
-            return 0
-        end
-        """
-        
-        result = self.redis.eval(script, 1, lock_key, identifier)
+        result = self._release_lock_script(keys=[lock_key, f"lockwait:{name}"], args=[identifier])
         if result:
             logger.debug(f"Released lock '{name}'")
             return True
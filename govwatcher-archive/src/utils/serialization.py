@@ -0,0 +1,26 @@
+"""
+JSON serialization helpers for the archive system.
+Uses orjson when it is installed and falls back to the standard library.
+"""
+import json
+import logging
+
+logger = logging.getLogger('govwatcher-archive.serialization')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    logger.warning("orjson not available, falling back to json")
+
+def dumps(obj):
+    """Serialize obj to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, default=str, separators=(',', ':')).encode('utf-8')
+
+def loads(data):
+    """Deserialize JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,7 @@
+"""
+Shared pytest setup, puts src on the import path the way main.py runs it.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,81 @@
+"""
+Tests for reading the domains CSV in utils.importers.
+"""
+from utils.importers import IMPORT_COLUMNS, _read_rows
+
+HEADER = 'domain,domainType,agency,organizationName,city,state,securityContact\n'
+
+def _read(tmp_path, text, priority_domains=()):
+    """Write text to a CSV file and read it back as {domain: {column: value}}"""
+    csv_file = tmp_path / 'domains.csv'
+    csv_file.write_text(text, encoding='utf-8')
+    total, rows = _read_rows(str(csv_file), set(priority_domains))
+    return total, {domain: dict(zip(IMPORT_COLUMNS, values)) for domain, values in rows.items()}
+
+def test_full_row(tmp_path):
+    total, rows = _read(tmp_path, HEADER + 'Example.GOV,Federal,GSA,Org,City,DC,sec@example.gov\n')
+    assert total == 1
+    assert rows == {
+        'example.gov': {
+            'domain': 'example.gov',
+            'domain_type': 'Federal',
+            'agency': 'GSA',
+            'organization_name': 'Org',
+            'city': 'City',
+            'state': 'DC',
+            'security_contact_email': 'sec@example.gov',
+            'priority': 3,
+            'enabled': True,
+        }
+    }
+
+def test_short_row_is_padded(tmp_path):
+    total, rows = _read(tmp_path, HEADER + 'short.gov,Federal\n')
+    assert total == 1
+    row = rows['short.gov']
+    assert row['domain_type'] == 'Federal'
+    assert row['agency'] is None
+    assert row['organization_name'] is None
+    assert row['security_contact_email'] is None
+
+def test_overlong_row_is_truncated(tmp_path):
+    total, rows = _read(tmp_path, 'domain,organizationName\nlong.gov,Org,extra,more\n')
+    assert total == 1
+    row = rows['long.gov']
+    assert row['organization_name'] == 'Org'
+    
+    # Absent columns read their defaults, not the extra fields past the header
+    assert row['domain_type'] is None
+    assert row['agency'] is None
+    assert row['city'] == ''
+    assert row['state'] == ''
+
+def test_missing_columns_use_defaults(tmp_path):
+    total, rows = _read(tmp_path, 'domain,federalAgency\nmin.gov,Dept\nmore.gov,Dept,extra\n')
+    assert total == 2
+    for domain in ('min.gov', 'more.gov'):
+        row = rows[domain]
+        assert row['domain_type'] is None
+        assert row['agency'] == 'Dept'  # Falls back to federalAgency
+        assert row['organization_name'] == ''
+        assert row['city'] == ''
+        assert row['state'] == ''
+        assert row['security_contact_email'] == ''
+
+def test_blank_lines_and_empty_domains_are_skipped(tmp_path):
+    total, rows = _read(tmp_path, HEADER + '\n,Federal\nok.gov\n')
+    assert total == 2  # The blank line isn't a row, the empty domain is
+    assert list(rows) == ['ok.gov']
+
+def test_repeated_domain_keeps_last_row(tmp_path):
+    total, rows = _read(tmp_path, HEADER + 'dup.gov,First\nDUP.gov,Second\n')
+    assert total == 2
+    assert rows['dup.gov']['domain_type'] == 'Second'
+
+def test_priority_domains(tmp_path):
+    _, rows = _read(tmp_path, HEADER + 'high.gov\nlow.gov\n', priority_domains={'high.gov'})
+    assert rows['high.gov']['priority'] == 1
+    assert rows['low.gov']['priority'] == 3
+
+def test_empty_file(tmp_path):
+    assert _read(tmp_path, '') == (0, {})
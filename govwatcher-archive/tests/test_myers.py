@@ -0,0 +1,81 @@
+"""
+Tests for the Myers line diff, checked against difflib's SequenceMatcher.
+"""
+import random
+from difflib import SequenceMatcher
+import pytest
+from processors.myers import myers_diff
+
+def _random_pair(rng, max_len=40, alphabet='abcde'):
+    """Two random sequences over a small alphabet, so they share plenty of lines"""
+    a = [rng.choice(alphabet) for _ in range(rng.randint(0, max_len))]
+    b = [rng.choice(alphabet) for _ in range(rng.randint(0, max_len))]
+    return a, b
+
+def _changed_lines(opcodes):
+    """Number of lines deleted plus inserted by a set of opcodes"""
+    return sum((i2 - i1) + (j2 - j1) for tag, i1, i2, j1, j2 in opcodes if tag != 'equal')
+
+def _check_opcodes(a, b, opcodes):
+    """Assert opcodes are well formed SequenceMatcher opcodes that turn a into b"""
+    i = j = 0
+    rebuilt = []
+    previous_tag = None
+    for tag, i1, i2, j1, j2 in opcodes:
+        # Opcodes tile both sequences from start to end without gaps
+        assert (i1, j1) == (i, j)
+        assert i1 <= i2 and j1 <= j2
+        
+        # Equal runs and edit runs alternate, as in SequenceMatcher
+        if previous_tag is not None:
+            assert (tag == 'equal') != (previous_tag == 'equal')
+        
+        if tag == 'equal':
+            assert a[i1:i2] == b[j1:j2]
+        elif tag == 'insert':
+            assert i1 == i2 and j1 < j2
+        elif tag == 'delete':
+            assert i1 < i2 and j1 == j2
+        else:
+            assert tag == 'replace' and i1 < i2 and j1 < j2
+        
+        rebuilt.extend(b[j1:j2])
+        i, j = i2, j2
+        previous_tag = tag
+    
+    assert (i, j) == (len(a), len(b))
+    assert rebuilt == b
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_sequence_matcher_on_random_input(seed):
+    rng = random.Random(seed)
+    for _ in range(1000):
+        a, b = _random_pair(rng)
+        opcodes = myers_diff(a, b)
+        expected = SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+        
+        _check_opcodes(a, b, opcodes)
+        
+        # Myers finds a shortest edit script, never longer than SequenceMatcher's
+        assert _changed_lines(opcodes) <= _changed_lines(expected)
+
+def test_identical_and_empty_input():
+    assert myers_diff([], []) == []
+    assert myers_diff(['a', 'b'], ['a', 'b']) == [('equal', 0, 2, 0, 2)]
+    assert myers_diff([], ['a']) == [('insert', 0, 0, 0, 1)]
+    assert myers_diff(['a'], []) == [('delete', 0, 1, 0, 0)]
+
+def test_common_prefix_and_suffix():
+    a = ['head', 'old', 'tail']
+    b = ['head', 'new', 'tail']
+    assert myers_diff(a, b) == [
+        ('equal', 0, 1, 0, 1),
+        ('replace', 1, 2, 1, 2),
+        ('equal', 2, 3, 2, 3),
+    ]
+
+def test_falls_back_to_sequence_matcher_above_max_edit_distance():
+    rng = random.Random(42)
+    a, b = _random_pair(rng, max_len=200)
+    opcodes = myers_diff(a, b, max_edit_distance=1)
+    assert opcodes == SequenceMatcher(None, a, b).get_opcodes()
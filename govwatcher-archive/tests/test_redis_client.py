@@ -0,0 +1,126 @@
+"""
+Tests for the RedisClient queue and lock scripts, run against fakeredis.
+"""
+import functools
+import threading
+import time
+import pytest
+from utils import redis_client
+from utils.redis_client import RedisClient
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')  # fakeredis needs lupa to run the Lua scripts
+
+@pytest.fixture
+def client(monkeypatch):
+    """A RedisClient connected to a fresh in-memory server"""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_client.redis, 'Redis',
+                        functools.partial(fakeredis.FakeRedis, server=server))
+    client = RedisClient('localhost', 6379)
+    yield client
+    client.close()
+
+def test_get_next_job_pops_by_priority(client):
+    client.enqueue_job('crawl', {'id': 1}, priority=5)
+    client.enqueue_job('crawl', {'id': 2}, priority=1)
+    client.enqueue_job('crawl', {'id': 3}, priority=3)
+    
+    assert [client.get_next_job('crawl')['data']['id'] for _ in range(3)] == [2, 3, 1]
+    assert client.get_next_job('crawl') is None
+
+def test_get_next_job_marks_processing(client):
+    job_id = client.enqueue_job('crawl', {'id': 7, 'domain': 'example.gov'}, priority=2)
+    
+    job = client.get_next_job('crawl')
+    assert job['id'] == job_id
+    assert job['priority'] == 2
+    assert job['data'] == {'id': 7, 'domain': 'example.gov'}
+    
+    assert client.redis.hget(f"jobs:{job_id}", 'status') == 'processing'
+    assert client.redis.sismember('processing:crawl', job_id)
+    assert client.redis.zcard('queue:crawl') == 0
+
+def test_get_next_job_skips_missing_job_data(client):
+    client.redis.zadd('queue:crawl', {'job:0:gone': 1})
+    
+    assert client.get_next_job('crawl') is None
+    assert not client.redis.sismember('processing:crawl', 'job:0:gone')
+
+def test_dequeue_batch(client):
+    client.enqueue_jobs_batch('crawl', [({'id': i}, priority) for i, priority in enumerate([4, 1, 3, 2])])
+    
+    jobs = client.dequeue_batch('crawl', 3)
+    assert [job['data']['id'] for job in jobs] == [1, 3, 2]
+    assert client.redis.scard('processing:crawl') == 3
+    assert client.redis.zcard('queue:crawl') == 1
+    
+    assert [job['data']['id'] for job in client.dequeue_batch('crawl', 3)] == [0]
+    assert client.dequeue_batch('crawl', 3) == []
+    assert client.dequeue_batch('crawl', 0) == []
+
+def test_fail_job_requeues_until_retries_run_out(client):
+    job_id = client.enqueue_job('crawl', {'id': 1}, priority=3)
+    
+    for attempt in range(2):
+        client.get_next_job('crawl')
+        assert client.fail_job('crawl', job_id, error='boom', retry=True, max_retries=2) is True
+        assert client.redis.hget(f"jobs:{job_id}", 'retries') == str(attempt + 1)
+    
+    client.get_next_job('crawl')
+    assert client.fail_job('crawl', job_id, error='boom', retry=True, max_retries=2) is False
+    assert client.redis.hget(f"jobs:{job_id}", 'status') == 'failed'
+    assert client.redis.zcard('queue:crawl') == 0
+    assert client.redis.scard('processing:crawl') == 0
+
+def test_complete_job(client):
+    job_id = client.enqueue_job('crawl', {'id': 1})
+    client.get_next_job('crawl')
+    
+    client.complete_job('crawl', job_id)
+    assert client.redis.hget(f"jobs:{job_id}", 'status') == 'completed'
+    assert client.get_queue_stats('crawl') == {
+        'pending': 0, 'processing': 0, 'completed': 1, 'failed': 0, 'total': 1
+    }
+
+def test_acquire_lock_sets_ttl_atomically(client):
+    identifier = client.acquire_lock('import', timeout=1, expire=30)
+    assert identifier
+    assert client.redis.get('lock:import') == identifier
+    assert 0 < client.redis.pttl('lock:import') <= 30000
+
+def test_acquire_lock_honours_sub_second_timeout(client):
+    assert client.acquire_lock('import', timeout=1, expire=30)
+    
+    start = time.monotonic()
+    assert client.acquire_lock('import', timeout=0.2, expire=30) is None
+    assert time.monotonic() - start < 0.9
+
+def test_release_lock_only_by_owner(client):
+    identifier = client.acquire_lock('import', timeout=1)
+    
+    assert client.release_lock('import', 'someone-else') is False
+    assert client.redis.get('lock:import') == identifier
+    
+    assert client.release_lock('import', identifier) is True
+    assert client.redis.get('lock:import') is None
+    assert client.acquire_lock('import', timeout=0.1)
+
+def test_acquire_lock_after_expiry(client):
+    assert client.acquire_lock('import', timeout=1, expire=0.1)
+    assert client.acquire_lock('import', timeout=1, expire=30)
+
+def test_waiter_wakes_on_release(client):
+    identifier = client.acquire_lock('import', timeout=1, expire=30)
+    acquired = []
+    
+    waiter = threading.Thread(target=lambda: acquired.append(client.acquire_lock('import', timeout=5)))
+    waiter.start()
+    time.sleep(0.1)
+    
+    start = time.monotonic()
+    client.release_lock('import', identifier)
+    waiter.join(timeout=5)
+    
+    assert acquired and acquired[0]
+    assert time.monotonic() - start < 2
@@ -149,6 +149,7 @@ CREATE TABLE audit_log (
 CREATE INDEX idx_archives_domain ON archives(domain);
 CREATE INDEX idx_archives_priority ON archives(priority);
 CREATE INDEX idx_archives_last_changed ON archives(last_changed_at DESC NULLS LAST);
+CREATE INDEX idx_archives_schedule ON archives(priority, last_checked_at NULLS FIRST) WHERE enabled;
 
 -- Snapshots table indexes
 CREATE INDEX idx_snapshots_archive_id ON snapshots(archive_id);